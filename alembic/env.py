@@ -5,11 +5,13 @@ from sqlalchemy import pool
 
 from alembic import context
 
-from db import SQLModel
+from db import DB_URL, SQLModel
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
+# Migrate the database the bot uses. "%" is escaped for configparser.
+config.set_main_option("sqlalchemy.url", DB_URL.replace("%", "%%"))
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
@@ -0,0 +1,46 @@
+"""unique index on banned.chat_id
+
+Revision ID: 4f1c2a9d7b10
+Revises: 
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4f1c2a9d7b10'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if not sa.inspect(op.get_bind()).has_table("banned"):
+        op.create_table(
+            "banned",
+            sa.Column("no", sa.Integer(), nullable=False),
+            sa.Column("chat_id", sa.Integer(), nullable=False),
+            sa.Column("username", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+            sa.Column("tried_unban", sa.Boolean(), nullable=False),
+            sa.PrimaryKeyConstraint("no"),
+        )
+    # Keep the oldest row per chat_id, carrying over tried_unban from duplicates.
+    op.execute(
+        """
+        UPDATE banned SET tried_unban = 1
+        WHERE no IN (SELECT MIN(no) FROM banned GROUP BY chat_id HAVING MAX(tried_unban) = 1)
+        """
+    )
+    op.execute("DELETE FROM banned WHERE no NOT IN (SELECT MIN(no) FROM banned GROUP BY chat_id)")
+    op.create_index("ix_banned_chat_id", "banned", ["chat_id"], unique=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_banned_chat_id", table_name="banned")
@@ -0,0 +1,68 @@
+"""survey archive with fts5 index
+
+Revision ID: c2d7a4e81f53
+Revises: 9b3e6d21c4a8
+Create Date: 2026-10-17 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2d7a4e81f53'
+down_revision: Union[str, Sequence[str], None] = '9b3e6d21c4a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "survey",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("sender_id", sa.Integer(), nullable=False),
+        sa.Column("username", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("text", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("media_ids", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("created", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        if_not_exists=True,
+    )
+    op.create_index("ix_survey_sender_id", "survey", ["sender_id"], unique=False, if_not_exists=True)
+    op.create_index("ix_survey_created", "survey", ["created"], unique=False, if_not_exists=True)
+    op.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS survey_fts USING fts5("
+        "text, username, content='survey', content_rowid='id', tokenize='unicode61')"
+    )
+    op.execute(
+        """CREATE TRIGGER IF NOT EXISTS survey_ai AFTER INSERT ON survey BEGIN
+        INSERT INTO survey_fts(rowid, text, username) VALUES (new.id, new.text, new.username);
+        END"""
+    )
+    op.execute(
+        """CREATE TRIGGER IF NOT EXISTS survey_ad AFTER DELETE ON survey BEGIN
+        INSERT INTO survey_fts(survey_fts, rowid, text, username) VALUES ('delete', old.id, old.text, old.username);
+        END"""
+    )
+    op.execute(
+        """CREATE TRIGGER IF NOT EXISTS survey_au AFTER UPDATE ON survey BEGIN
+        INSERT INTO survey_fts(survey_fts, rowid, text, username) VALUES ('delete', old.id, old.text, old.username);
+        INSERT INTO survey_fts(rowid, text, username) VALUES (new.id, new.text, new.username);
+        END"""
+    )
+    op.execute("INSERT INTO survey_fts(survey_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP TRIGGER IF EXISTS survey_au")
+    op.execute("DROP TRIGGER IF EXISTS survey_ad")
+    op.execute("DROP TRIGGER IF EXISTS survey_ai")
+    op.execute("DROP TABLE IF EXISTS survey_fts")
+    op.drop_index("ix_survey_created", table_name="survey")
+    op.drop_index("ix_survey_sender_id", table_name="survey")
+    op.drop_table("survey")
@@ -0,0 +1,50 @@
+"""broadcast and broadcasttarget tables
+
+Revision ID: d81b5f3a2c67
+Revises: c2d7a4e81f53
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd81b5f3a2c67'
+down_revision: Union[str, Sequence[str], None] = 'c2d7a4e81f53'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "broadcast",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("text", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("created", sa.Float(), nullable=False),
+        sa.Column("finished", sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        if_not_exists=True,
+    )
+    op.create_table(
+        "broadcasttarget",
+        sa.Column("broadcast_id", sa.Integer(), nullable=False),
+        sa.Column("chat_id", sa.Integer(), nullable=False),
+        sa.Column("status", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.PrimaryKeyConstraint("broadcast_id", "chat_id"),
+        if_not_exists=True,
+    )
+    op.create_index(
+        "ix_broadcasttarget_status", "broadcasttarget", ["status"], unique=False, if_not_exists=True
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_broadcasttarget_status", table_name="broadcasttarget")
+    op.drop_table("broadcasttarget")
+    op.drop_table("broadcast")
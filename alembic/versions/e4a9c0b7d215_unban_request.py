@@ -0,0 +1,49 @@
+"""unbanrequest table with the state of unban requests
+
+Revision ID: e4a9c0b7d215
+Revises: d81b5f3a2c67
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a9c0b7d215'
+down_revision: Union[str, Sequence[str], None] = 'd81b5f3a2c67'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "unbanrequest",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("chat_id", sa.Integer(), nullable=False),
+        sa.Column("status", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("decided_by", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("decided_at", sa.Float(), nullable=True),
+        sa.Column("created", sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        if_not_exists=True,
+    )
+    op.create_index("ix_unbanrequest_chat_id", "unbanrequest", ["chat_id"], unique=False, if_not_exists=True)
+    # Requests made so far are still open as far as anyone can tell. The
+    # table may already exist (create_tables() at bot startup), so users
+    # who have a request row keep it.
+    op.execute(
+        "INSERT INTO unbanrequest (chat_id, status, created) "
+        "SELECT chat_id, 'pending', strftime('%s', 'now') FROM banned "
+        "WHERE tried_unban = 1 AND chat_id NOT IN (SELECT chat_id FROM unbanrequest)"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_unbanrequest_chat_id", table_name="unbanrequest")
+    op.drop_table("unbanrequest")
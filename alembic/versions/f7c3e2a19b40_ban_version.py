@@ -0,0 +1,38 @@
+"""banversion counter of changes to banned
+
+Revision ID: f7c3e2a19b40
+Revises: e4a9c0b7d215
+Create Date: 2026-10-17 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7c3e2a19b40'
+down_revision: Union[str, Sequence[str], None] = 'e4a9c0b7d215'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(
+        "CREATE TABLE IF NOT EXISTS banversion (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)"
+    )
+    op.execute("INSERT OR IGNORE INTO banversion (id, version) VALUES (1, 0)")
+    for name, event in (("banned_ai", "INSERT"), ("banned_ad", "DELETE"), ("banned_au", "UPDATE")):
+        op.execute(
+            f"""CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON banned BEGIN
+            UPDATE banversion SET version = version + 1;
+            END"""
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name in ("banned_au", "banned_ad", "banned_ai"):
+        op.execute(f"DROP TRIGGER IF EXISTS {name}")
+    op.execute("DROP TABLE IF EXISTS banversion")
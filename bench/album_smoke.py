@@ -0,0 +1,84 @@
+"""Offline check of the oversized album path against the fake Bot API.
+
+An album of 4 photos must be rejected with a notice and leave nothing in
+the outbox, and the sender's next survey must go through normally.
+
+    python -m bench.album_smoke
+"""
+import asyncio
+import tempfile
+import time
+
+from bench.fake_api import FakeBotAPI, configure_env, text_update
+
+configure_env(tempfile.mkdtemp())
+
+from sqlmodel import Session, select  # noqa: E402
+from telegram import Update  # noqa: E402
+
+import bot  # noqa: E402
+import db  # noqa: E402
+import sender  # noqa: E402
+
+APPLICANT = 555
+
+
+def photo_update(message_id: int, group_id: str) -> dict:
+    file_id = f"photo-{message_id}"
+    return {
+        "message": {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": APPLICANT, "type": "private"},
+            "from": {"id": APPLICANT, "is_bot": False, "first_name": "User", "username": "applicant"},
+            "media_group_id": group_id,
+            "photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}],
+        }
+    }
+
+
+def sent_to(api: FakeBotAPI, chat_id: int, prefix: str) -> bool:
+    return any(
+        method == "sendMessage" and int(params.get("chat_id", 0)) == chat_id and str(params.get("text", "")).startswith(prefix)
+        for method, params, _ in api.calls
+    )
+
+
+async def wait_for(check, what: str, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() > deadline:
+            raise AssertionError(f"timed out waiting for {what}")
+        await asyncio.sleep(0.05)
+
+
+async def main() -> None:
+    bot.SURVEY_PART_QUIET = bot.SURVEY_MEDIA_QUIET = 0.3
+    sender.GROUP_RATE = sender.PRIVATE_RATE = sender.GLOBAL_RATE = 10_000
+    api = FakeBotAPI()
+    await api.start()
+    db.create_tables()
+    app = bot.build_application(base_url=api.base_url)
+    async with app:
+        await app.updater.start_polling(poll_interval=0, timeout=1, allowed_updates=Update.ALL_TYPES)
+        await app.start()
+        await bot.on_startup(app)
+        for message_id in range(1, 5):
+            api.push_update(photo_update(message_id, "album"))
+        await wait_for(lambda: sent_to(api, APPLICANT, "К анкете можно прикрепить не более 3 фото"), "the rejection notice")
+        await wait_for(lambda: APPLICANT not in bot.submissions, "the rejected album to be dropped")
+        with Session(db.engine) as s:
+            assert not s.exec(select(db.Outbox)).all(), "rejected album left rows in the outbox"
+        api.push_update(text_update(APPLICANT, "Анкета после отказа", 10))
+        await wait_for(lambda: sent_to(api, APPLICANT, "Спасибо за заявку"), "the next survey to be delivered")
+        assert not sent_to(api, APPLICANT, "Упс"), "the sender got an error after the rejected album"
+        assert api.count("copyMessages") == 1, "the rejected album was forwarded"
+        await bot.on_shutdown(app)
+        await app.updater.stop()
+        await app.stop()
+    await api.stop()
+    print("album smoke check passed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
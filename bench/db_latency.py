@@ -0,0 +1,69 @@
+"""Handler latency under concurrent ban/unban writes.
+
+Compares calling the blocking db functions straight from coroutines with
+awaiting their *_async variants. Run from the repository root:
+
+    python -m bench.db_latency [writers] [seconds]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("DB_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+
+import db  # noqa: E402
+
+
+async def writer(n: int, stop: float, use_async: bool) -> int:
+    done = 0
+    chat_id = 10_000_000 + n
+    while time.monotonic() < stop:
+        if use_async:
+            await db.ban_async(chat_id)
+            await db.unban_async(chat_id)
+        else:
+            db.ban(chat_id)
+            db.unban(chat_id)
+            await asyncio.sleep(0)
+        done += 2
+    return done
+
+
+async def handler_probe(stop: float) -> list[float]:
+    """Stand-in for a survey handler: cache lookup plus a scheduling hop."""
+    samples = []
+    while time.monotonic() < stop:
+        start = time.perf_counter()
+        db.check(1)
+        await asyncio.sleep(0.005)
+        samples.append((time.perf_counter() - start - 0.005) * 1000)
+    return samples
+
+
+async def run(writers: int, seconds: float, use_async: bool) -> None:
+    stop = time.monotonic() + seconds
+    results = await asyncio.gather(
+        handler_probe(stop), *(writer(i, stop, use_async) for i in range(writers))
+    )
+    samples = sorted(results[0])
+    writes = sum(results[1:])
+    p99 = samples[int(len(samples) * 0.99) - 1] if samples else 0.0
+    print(
+        f"{'async' if use_async else 'sync ':5} writers={writers} writes/s={writes / seconds:8.1f} "
+        f"handler delay ms: p50={statistics.median(samples):7.2f} p99={p99:7.2f} max={samples[-1]:7.2f}"
+    )
+
+
+def main() -> None:
+    writers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    db.create_tables()
+    asyncio.run(run(writers, seconds, use_async=False))
+    asyncio.run(run(writers, seconds, use_async=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Minimal stand-in for the Telegram Bot API, for offline runs.
+
+Answers every method with a plausible result and records the calls.
+Point the bot at it with build_application(base_url=api.base_url).
+"""
+import asyncio
+import itertools
+import json
+import os
+import time
+from typing import Any, Callable
+from urllib.parse import parse_qsl
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+MESSAGE_METHODS = {"sendMessage", "sendPhoto", "sendVideo", "sendDocument", "sendAudio", "editMessageText"}
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.calls: list[tuple[str, dict[str, Any], float]] = []
+        self.updates: asyncio.Queue[dict] = asyncio.Queue()
+        self.on_call: Callable[[str, dict[str, Any]], None] | None = None
+        self._ids = itertools.count(1000)
+        self._update_ids = itertools.count(1)
+        self._server: asyncio.Server | None = None
+        self._connections: set[asyncio.Task] = set()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            # Long-polling getUpdates calls would otherwise hold the server open.
+            for task in self._connections:
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+
+    def count(self, method: str) -> int:
+        return sum(1 for name, _, _ in self.calls if name == method)
+
+    def push_update(self, update: dict) -> None:
+        """Queue an update for getUpdates, filling in update_id."""
+        update.setdefault("update_id", next(self._update_ids))
+        self.updates.put_nowait(update)
+
+    def _message(self, params: dict[str, Any]) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        return {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+            "text": params.get("text") or params.get("caption") or "",
+        }
+
+    async def _result(self, method: str, params: dict[str, Any]) -> Any:
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            timeout = min(float(params.get("timeout", 0) or 0), 1.0)
+            updates = []
+            try:
+                updates.append(await asyncio.wait_for(self.updates.get(), timeout or 0.01))
+            except asyncio.TimeoutError:
+                return []
+            while not self.updates.empty() and len(updates) < 100:
+                updates.append(self.updates.get_nowait())
+            return updates
+        if method in MESSAGE_METHODS:
+            return self._message(params)
+        if method == "copyMessage":
+            return {"message_id": next(self._ids)}
+        if method == "copyMessages":
+            return [{"message_id": next(self._ids)} for _ in params.get("message_ids", [])]
+        if method == "sendMediaGroup":
+            return [self._message(params) for _ in params.get("media", [])]
+        return True
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    key, value = line.decode().split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                method = path.rstrip("/").rsplit("/", 1)[-1]
+                params = self._parse(headers.get("content-type", ""), body)
+                self.calls.append((method, params, time.perf_counter()))
+                if self.on_call:
+                    self.on_call(method, params)
+                if self.latency and method != "getUpdates":
+                    await asyncio.sleep(self.latency)
+                payload = json.dumps({"ok": True, "result": await self._result(method, params)}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Cancelled by stop(), usually while waiting in getUpdates.
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    @staticmethod
+    def _parse(content_type: str, body: bytes) -> dict[str, Any]:
+        if content_type.startswith("application/json"):
+            return json.loads(body or b"{}")
+        if content_type.startswith("multipart/form-data"):
+            # File uploads are not inspected, only the method is recorded.
+            return {}
+        params: dict[str, Any] = {}
+        for key, value in parse_qsl(body.decode()):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+
+SURVEY_CHAT = -1001
+MAIN_CHAT = -1002
+UNBAN_CHAT = -1003
+DEV_CHAT = 42
+
+
+def configure_env(db_dir: str) -> None:
+    """Set the environment bot.py reads at import time to fake values."""
+    os.environ.setdefault("DB_URL", f"sqlite:///{db_dir}/banned.db")
+    os.environ["TOKEN"] = "1:fake"
+    os.environ["CHAT"] = str(SURVEY_CHAT)
+    os.environ["CHAT_SURVEYS"] = str(SURVEY_CHAT)
+    os.environ["СHAT_MAIN"] = str(MAIN_CHAT)
+    os.environ["UNBAN_REQUESTS"] = str(UNBAN_CHAT)
+    os.environ["DEV_ID"] = str(DEV_CHAT)
+
+
+def text_update(chat_id: int, text: str, message_id: int = 1, username: str | None = "applicant") -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": "User", "username": username}
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+        "from": user,
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"message": message}
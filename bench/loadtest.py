@@ -0,0 +1,186 @@
+"""Load test of the real Application against the fake Bot API.
+
+Feeds synthetic updates through long polling (text surveys, albums,
+bans in the main chat and unban callbacks) and reports throughput,
+end-to-end latency and outbound call counts. Run from the repo root:
+
+    python -m bench.loadtest --unlimited --users 200 --albums 50 --bans 20
+
+Without --unlimited the real flood limits apply. Every survey then costs
+about 3 seconds of the surveys chat's 20 messages/min, so a default run
+of 100 users takes well over ten minutes.
+"""
+import argparse
+import asyncio
+import itertools
+import statistics
+import tempfile
+import time
+
+from bench.fake_api import MAIN_CHAT, SURVEY_CHAT, UNBAN_CHAT, FakeBotAPI, configure_env, text_update
+
+configure_env(tempfile.mkdtemp())
+
+from telegram import Update  # noqa: E402
+
+import bot  # noqa: E402
+import db  # noqa: E402
+import sender  # noqa: E402
+
+ADMIN = {"id": 7, "is_bot": False, "first_name": "Admin", "username": "admin"}
+message_ids = itertools.count(1)
+
+
+def user(chat_id: int) -> dict:
+    return {"id": chat_id, "is_bot": False, "first_name": "User", "username": f"user{chat_id}"}
+
+
+def album_updates(chat_id: int, size: int, group_id: str) -> list[dict]:
+    updates = []
+    for i in range(size):
+        file_id = f"photo-{group_id}-{i}"
+        updates.append({
+            "message": {
+                "message_id": next(message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": user(chat_id),
+                "media_group_id": group_id,
+                "photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}],
+                "caption": "Анкета с картинками" if i == 0 else None,
+            }
+        })
+    return updates
+
+
+def ban_update(chat_id: int) -> dict:
+    return {
+        "chat_member": {
+            "chat": {"id": MAIN_CHAT, "type": "supergroup", "title": "main"},
+            "from": ADMIN,
+            "date": int(time.time()),
+            "old_chat_member": {"status": "member", "user": user(chat_id)},
+            "new_chat_member": {"status": "kicked", "user": user(chat_id), "until_date": 0},
+        }
+    }
+
+
+def unban_callback(chat_id: int) -> dict:
+    return {
+        "callback_query": {
+            "id": f"cb{chat_id}",
+            "from": ADMIN,
+            "chat_instance": "bench",
+            "data": f"unban_accept_{chat_id}",
+            "message": {
+                "message_id": next(message_ids),
+                "date": int(time.time()),
+                "chat": {"id": UNBAN_CHAT, "type": "supergroup", "title": "unban"},
+                "text": f"Unban request from user: {chat_id}",
+            },
+        }
+    }
+
+
+class Tracker:
+    """Matches outbound calls to the synthetic events that caused them."""
+
+    def __init__(self):
+        self.started: dict[tuple, float] = {}
+        self.latencies: dict[str, list[float]] = {}
+
+    def start(self, key: tuple) -> None:
+        self.started[key] = time.perf_counter()
+
+    def on_call(self, method: str, params: dict) -> None:
+        if method != "sendMessage":
+            return
+        chat_id, text = params.get("chat_id"), str(params.get("text", ""))
+        if text.startswith("Спасибо за заявку"):
+            self._done(("survey", chat_id))
+        elif chat_id == SURVEY_CHAT and "забанен" in text:
+            self._done(("ban", int(text.split()[1])))
+        elif text.startswith("Ваша заявка получена"):
+            self._done(("unban", chat_id))
+
+    def _done(self, key: tuple) -> None:
+        start = self.started.pop(key, None)
+        if start is not None:
+            self.latencies.setdefault(key[0], []).append(time.perf_counter() - start)
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run(args: argparse.Namespace) -> None:
+    bot.SURVEY_PART_QUIET = args.part_quiet
+    bot.SURVEY_MEDIA_QUIET = min(bot.SURVEY_MEDIA_QUIET, args.part_quiet)
+    if args.unlimited:
+        sender.GROUP_RATE = sender.PRIVATE_RATE = sender.GLOBAL_RATE = 10_000
+    api = FakeBotAPI(latency=args.latency)
+    await api.start()
+    tracker = Tracker()
+    api.on_call = tracker.on_call
+    db.create_tables()
+    app = bot.build_application(base_url=api.base_url)
+    users = range(100_000, 100_000 + args.users)
+    banned = range(200_000, 200_000 + args.bans)
+    for chat_id in banned:
+        db.ban(chat_id)
+    async with app:
+        await app.updater.start_polling(poll_interval=0, timeout=1, allowed_updates=Update.ALL_TYPES)
+        await app.start()
+        # post_init only runs from run_polling/run_webhook; it starts the outbox worker.
+        await bot.on_startup(app)
+        start = time.perf_counter()
+        for chat_id in users:
+            tracker.start(("survey", chat_id))
+            api.push_update(text_update(chat_id, f"Анкета {chat_id}\n" + "текст " * 200, next(message_ids)))
+        for n, chat_id in enumerate(users[: args.albums]):
+            for update in album_updates(chat_id + 1_000_000, 3, f"album{n}"):
+                api.push_update(update)
+            tracker.start(("survey", chat_id + 1_000_000))
+        for chat_id in banned:
+            tracker.start(("unban", chat_id))
+            api.push_update(unban_callback(chat_id))
+        for chat_id in range(300_000, 300_000 + args.bans):
+            tracker.start(("ban", chat_id))
+            api.push_update(ban_update(chat_id))
+        deadline = time.monotonic() + args.timeout
+        while tracker.started and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - start
+        await bot.on_shutdown(app)
+        await app.updater.stop()
+        await app.stop()
+    await api.stop()
+
+    done = sum(len(v) for v in tracker.latencies.values())
+    print(f"completed {done} events in {elapsed:.2f}s, {done / elapsed:.1f} events/s, {len(tracker.started)} timed out")
+    for kind, values in sorted(tracker.latencies.items()):
+        print(
+            f"  {kind:7} n={len(values):5} p50={statistics.median(values) * 1000:8.1f}ms "
+            f"p99={percentile(values, 0.99) * 1000:8.1f}ms max={max(values) * 1000:8.1f}ms"
+        )
+    print("outbound calls:")
+    methods = sorted({method for method, _, _ in api.calls})
+    for method in methods:
+        print(f"  {method:20} {api.count(method)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100, help="applicants sending one text survey each")
+    parser.add_argument("--albums", type=int, default=20, help="applicants sending a 3-photo album")
+    parser.add_argument("--bans", type=int, default=10, help="main chat bans and unban callbacks each")
+    parser.add_argument("--latency", type=float, default=0.02, help="fake Bot API latency per call, seconds")
+    parser.add_argument("--part-quiet", type=float, default=1.0, help="override SURVEY_PART_QUIET")
+    parser.add_argument("--unlimited", action="store_true", help="disable the flood limits")
+    parser.add_argument("--timeout", type=float, default=300)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Offline check of the webhook serving mode against the fake Bot API.
+
+    python -m bench.webhook_smoke
+"""
+import asyncio
+import os
+import socket
+import tempfile
+
+from bench.fake_api import FakeBotAPI, configure_env, text_update
+
+configure_env(tempfile.mkdtemp())
+
+import httpx  # noqa: E402
+
+import bot  # noqa: E402
+import db  # noqa: E402
+
+SECRET = "smoke-secret"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def main() -> None:
+    api = FakeBotAPI()
+    await api.start()
+    db.create_tables()
+    app = bot.build_application(base_url=api.base_url)
+    port = free_port()
+    os.environ.update(
+        WEBHOOK_URL=f"http://127.0.0.1:{port}/telegram",
+        WEBHOOK_SECRET=SECRET,
+        WEBHOOK_LISTEN="127.0.0.1",
+        WEBHOOK_PORT=str(port),
+        WEBHOOK_PATH="telegram",
+    )
+    # The same arguments main() passes to run_webhook.
+    options = bot.webhook_options()
+    url = options["webhook_url"]
+    async with app:
+        await app.updater.start_webhook(**options)
+        await app.start()
+        assert api.count("setWebhook") == 1, "webhook was not registered"
+        update = {"update_id": 1, **text_update(555, "/start")}
+        async with httpx.AsyncClient() as client:
+            bad = await client.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+            assert bad.status_code == 403, f"wrong secret accepted: {bad.status_code}"
+            good = await client.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": SECRET})
+            assert good.status_code == 200, f"update rejected: {good.status_code}"
+        for _ in range(50):
+            if any(m == "sendMessage" and p.get("chat_id") == 555 for m, p, _ in api.calls):
+                break
+            await asyncio.sleep(0.1)
+        else:
+            raise AssertionError("no reply to the webhook update")
+        await app.updater.stop()
+        await app.stop()
+    await api.stop()
+    print("webhook smoke check passed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,10 +1,17 @@
 import asyncio
+import csv
+import io
+import json
 import os
+import tempfile
+import time
 import traceback
-from typing import Literal, TypedDict, cast, List
+from collections import OrderedDict
+from typing import Coroutine, Literal, TypedDict
 
 from telegram import (
     Bot,
+    CallbackQuery,
     Update,
     Message,
     InputMediaVideo,
@@ -12,12 +19,9 @@ from telegram import (
     InputMediaDocument,
     InputMediaAudio,
     error,
-    Video,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
 )
-from telegram.helpers import effective_message_type
-from telegram.error import TimedOut
 from telegram.ext import (
     Application,
     ContextTypes,
@@ -26,11 +30,51 @@ from telegram.ext import (
     filters,
     ChatMemberHandler,
     CallbackQueryHandler,
+    Job,
+    ApplicationHandlerStop,
 )
 from dotenv import load_dotenv
 
-from db import create_tables, check, check_unbans, ban, unban, user_tried_unban, banlist
+from chunking import MESSAGE_LIMIT, split_message
+from db import (
+    Outbox,
+    Survey,
+    create_tables,
+    check,
+    ban_status,
+    ban_async,
+    unban_async,
+    request_unban_async,
+    decide_unban_async,
+    UnbanDecision,
+    banlist_page_async,
+    run_db,
+    bulk_ban,
+    bulk_unban,
+    export_bans_csv,
+    outbox_add,
+    outbox_mark_ready,
+    outbox_mark_copied,
+    outbox_drop,
+    outbox_resume,
+    outbox_pending,
+    outbox_done,
+    outbox_complete,
+    find_surveys,
+    outbox_retry,
+    refresh_bans,
+    broadcast_create,
+    broadcast_pending,
+    broadcast_mark,
+    broadcast_finish,
+    broadcast_unfinished,
+)
+from errors import ERROR_DIGEST_INTERVAL, ErrorReporter
+from guard import SpamGuard, TTLCache
 from logs import get_logger
+import metrics
+from processing import ChatOrderedProcessor
+from sender import FloodLimiter
 
 load_dotenv()
 group_id = os.getenv("CHAT")
@@ -39,6 +83,50 @@ main_chat = int(os.getenv("СHAT_MAIN"))
 unbanner = os.environ["UNBAN_REQUESTS"]
 logger = get_logger()
 dev_id = os.environ["DEV_ID"]
+error_reporter = ErrorReporter(dev_id)
+spam_guard = SpamGuard()
+
+# Multi-part surveys are assembled per sender. Text parts wait longer for
+# a follow-up than media, since album items arrive within a second.
+SURVEY_PART_QUIET = 10
+SURVEY_MEDIA_QUIET = 1.5
+SURVEY_MAX_WAIT = 60
+MEDIA_GROUP_LIMIT = 3
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_BATCH = 20
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_POLL = 5
+outbox_wakeup = asyncio.Event()
+
+# Set by shard.py when running as one of several worker processes.
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+BAN_SYNC_INTERVAL = 2
+
+COPY_MESSAGES_LIMIT = 100
+
+# Messages of a broadcast or batch /answer in flight at once. Keeps room
+# under the flood limits for surveys that arrive meanwhile.
+BROADCAST_CONCURRENCY = 8
+BROADCAST_CHUNK = 200
+
+FIND_PAGE_SIZE = 10
+FIND_QUERIES_KEPT = 50
+
+# Recent unban decisions, so repeated button presses skip the database.
+UNBAN_DECISIONS_KEPT = 1000
+UNBAN_DECISION_TTL = 60 * 60
+unban_decisions: TTLCache[tuple[int, int | None], UnbanDecision] = TTLCache(UNBAN_DECISIONS_KEPT, UNBAN_DECISION_TTL)
+UNBAN_STATUS_TEXT = {"accepted": "✅ Принято", "rejected": "❌ Отклонено"}
+
+BANS_PAGE_SIZE = 50
+BAN_FILTERS = {"all": None, "tried": True, "untried": False}
+
+GUARD_NOTICES = {
+    "throttled": "Слишком много сообщений! Пожалуйста, подождите немного и отправьте снова.",
+    "duplicate": "Эта анкета уже была отправлена, она будет рассмотрена.",
+}
 
 MEDIA_GROUP_TYPES = {
     "audio": InputMediaAudio,
@@ -48,22 +136,53 @@ MEDIA_GROUP_TYPES = {
 }
 
 
+class BannedFilter(filters.MessageFilter):
+    """Matches messages from users in the ban cache."""
+
+    def filter(self, message: Message) -> bool:
+        return message.from_user is not None and check(message.from_user.id)
+
+
+banned_users = BannedFilter(name="banned_users")
+
+
 class MsgDict(TypedDict):
-    media_type: Literal["video", "photo"]
-    media_id: str
-    caption: str
-    post_id: int
+    text: str | None
+    media_type: Literal["video", "photo"] | None
+    media_id: str | None
+    message_id: int
     sender_id: int
+    sender_username: str | None
+
+
+class PendingSubmission(TypedDict):
+    batch: str
+    media: int
+    job: Job | None
+    deadline: float
+    # media_group_id of an album that broke the limit ("" for a single file)
+    rejected: str | None
+    flushed: bool
+
+
+# Handlers and flush jobs run concurrently. They never await between
+# reading and updating an entry, so the dict needs no lock.
+submissions: dict[int, PendingSubmission] = {}
+
+metrics.gauge("bot_pending_submissions", "Surveys still being assembled", lambda: len(submissions))
+outbox_retries = metrics.counter("bot_outbox_retries_total", "Survey deliveries scheduled for retry")
 
 
 async def process_exception(bot, id, err: Exception):
     logger.exception(err)
     text = "Упс! Неизвестная ошибка. Пожалуйста, свяжитесь с админинстрацией."
-    await bot.send_message(id, text)
-    dev_text = f"Error on prod survey for {id}: {str(err)}\n" + traceback.format_exc()
-    messages = [dev_text[i:i+1900] for i in range(0, len(dev_text), 1900)]
-    for i in messages:
-        await bot.send_message(dev_id, i)
+    spam_guard.forget(id)
+    try:
+        await bot.send_message(id, text)
+    except error.TelegramError as notice_err:
+        # E.g. the user blocked the bot. The report below still goes out.
+        logger.warning(f"Could not notify {id} about an error: {notice_err}")
+    await error_reporter.report(bot, err, id, f"Error on prod survey for {id}")
 
 
 def edit_text(text: str, id: str, username: str | None) -> str:
@@ -77,87 +196,363 @@ def edit_text(text: str, id: str, username: str | None) -> str:
     return text
 
 
+def survey_tail(text: str) -> str:
+    """The #анкета tag block ending a survey, which must not be split."""
+    start = text.rfind("\n#анкета")
+    return text[start:] if start != -1 else ""
+
+
+async def send_chunks(bot: Bot, chat_id: int | str, chunks: list[str], alongside: Coroutine | None = None):
+    """Send chunks in order. Once the first chunk is delivered, alongside
+    (e.g. the reply to the applicant) runs concurrently with the rest.
+    """
+    if not chunks:
+        if alongside:
+            await alongside
+        return
+    try:
+        await bot.send_message(chat_id, chunks[0])
+    except Exception:
+        if alongside:
+            alongside.close()
+        raise
+
+    async def rest():
+        for chunk in chunks[1:]:
+            await bot.send_message(chat_id, chunk)
+
+    if alongside:
+        await asyncio.gather(rest(), alongside)
+    else:
+        await rest()
+
+
+async def fan_out(bot: Bot, chat_ids: list[int], text: str) -> dict[int, str]:
+    """Send text to every chat, BROADCAST_CONCURRENCY at a time.
+
+    Returns the outcome per chat: delivered, blocked or failed.
+    """
+    limit = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    chunks = split_message(text)
+    results: dict[int, str] = {}
+
+    async def send(chat_id: int):
+        async with limit:
+            try:
+                await send_chunks(bot, chat_id, chunks)
+                results[chat_id] = "delivered"
+            except error.Forbidden:
+                results[chat_id] = "blocked"
+            except Exception as err:
+                logger.warning(f"Could not send to {chat_id}: {err}")
+                results[chat_id] = "failed"
+
+    await asyncio.gather(*(send(chat_id) for chat_id in chat_ids))
+    return results
+
+
+def outcome_text(counts: dict[str, int]) -> str:
+    return (
+        f"доставлено: {counts.get('delivered', 0)}, заблокировали бота: {counts.get('blocked', 0)}, "
+        f"ошибок: {counts.get('failed', 0)}"
+    )
+
+
+async def answer_many(bot: Bot, ids: list[str], reply_text: str):
+    chat_ids = []
+    for value in ids:
+        try:
+            chat_ids.append(int(value))
+        except ValueError:
+            await bot.send_message(survey_id, f"Неверный id: {value}")
+            return
+    results = await fan_out(bot, list(dict.fromkeys(chat_ids)), reply_text)
+    counts: dict[str, int] = {}
+    for status in results.values():
+        counts[status] = counts.get(status, 0) + 1
+    logger.debug(f"Answered back to {len(results)} users: {counts}")
+    await bot.send_message(survey_id, "Ответ отправлен, " + outcome_text(counts))
+
+
 async def answer_back(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat.id != int(survey_id):
         return
     full_text: str = update.message.text.replace("/answer", "")
-    chat_id, reply_text = full_text.strip().split("\n", 1)
+    ids, reply_text = full_text.strip().split("\n", 1)
+    ids = ids.replace(",", " ").split()
+    if len(ids) > 1:
+        await answer_many(context.bot, ids, reply_text)
+        return
+    chat_id = ids[0]
     try:
         await context.bot.send_message(chat_id, reply_text)
         logger.debug(f"Answered back to {chat_id}")
     except Exception as err:
         logger.exception(f"Error answering back to {chat_id}: {traceback.format_exc()}")
         await context.bot.send_message(survey_id, f"Ошибка при ответе юзеру {chat_id}!")
-        dev_text = f"Error on prod survey answer for {chat_id}: {str(err)}\n" + traceback.format_exc()
-        messages = [dev_text[i:i+1900] for i in range(0, len(dev_text), 1900)]
-        for i in messages:
-            await context.bot.send_message(dev_id, i)
+        await error_reporter.report(context.bot, err, chat_id, f"Error on prod survey answer for {chat_id}")
 
 
 async def reply(bot, id):
+    """Acknowledge a forwarded survey. Best effort: the survey is already
+    delivered, and a failure here must not make the outbox send it again.
+    """
     reply_text = (
         "Спасибо за заявку! Ваша анкета была направлена админинстраторам на проверку."
     )
-    await bot.send_message(id, reply_text)
+    try:
+        await bot.send_message(id, reply_text)
+    except error.TelegramError as err:
+        logger.warning(f"Could not acknowledge the survey of {id}: {err}")
 
 
-async def send_survey(message: str, context: ContextTypes.DEFAULT_TYPE):
-    messages = [message[i:i+1900] for i in range(0, len(message), 1900)]
-    for message in messages:
-        try:
-            await context.bot.send_message(survey_id, message)
-        except TimedOut as e:
-            logger.warning(e)
-            count = 0
-            while count < 3:
-                await asyncio.sleep(2)
-                try:
-                    await context.bot.send_message(survey_id, message)
-                    break
-                except TimedOut as err:
-                    count +=1
-                    logger.warning(f"Timed out time {count} {err}")
-                    pass
-            if count >= 3:
-                raise Exception from e
-
-
-async def send_survey_media(media, caption: str, context: ContextTypes.DEFAULT_TYPE):
-    if isinstance(media, Video):
-        await context.bot.send_video(survey_id, media, caption=caption)
+async def send_survey(message: str, bot: Bot, alongside: Coroutine | None = None):
+    await send_chunks(bot, survey_id, split_message(message, tail=survey_tail(message)), alongside)
+
+
+async def send_survey_media(media_type: str, media_id: str, caption: str | None, bot: Bot):
+    if media_type == "video":
+        await bot.send_video(survey_id, media_id, caption=caption)
     else:
-        await context.bot.send_photo(survey_id, media, caption)
-
-
-async def send_survey_media_group(context: ContextTypes.DEFAULT_TYPE):
-    bot = context.bot
-    context.job.data = cast(List[MsgDict], context.job.data)
-    media = []
-    sender = context.job.data[0].get("sender_id")
-    text = ""
-    for msg_dict in context.job.data:
-        text += (
-            edit_text(msg_dict["caption"], str(msg_dict["sender_id"]), msg_dict["sender_username"])
-            if msg_dict["caption"]
-            else ""
-        )
-        media.append(
-            MEDIA_GROUP_TYPES[msg_dict["media_type"]](
-                media=msg_dict["media_id"]
-            )
+        await bot.send_photo(survey_id, media_id, caption)
+
+
+async def copy_submission(
+    rows: list[Outbox], parts: list[MsgDict], sender: int, username: str | None, bot: Bot
+) -> bool:
+    """Copy the sender's original messages server side, in one call.
+
+    Returns False when Telegram refuses the copy, e.g. because a message
+    was deleted or has protected content. A retry of a batch that was
+    already copied only sends the header.
+    """
+    if rows[0].kind != "copied":
+        message_ids = sorted(part["message_id"] for part in parts)
+        if len(message_ids) > COPY_MESSAGES_LIMIT:
+            return False
+        try:
+            await bot.copy_messages(survey_id, sender, message_ids)
+        except error.BadRequest as err:
+            logger.warning(f"copy_messages failed for {sender}, re-sending instead: {err}")
+            return False
+        await run_db(outbox_mark_copied, [row.id for row in rows])
+    header = f"Sender chat id: {sender}\n#анкета{sender}" + (f"\nusername: {username}" if username else "")
+    await send_survey(header, bot, alongside=reply(bot, sender))
+    return True
+
+
+async def resend_submission(parts: list[MsgDict], sender: int, username: str | None, bot: Bot):
+    """Rebuild the submission from file ids and text."""
+    texts = [part["text"] for part in parts if part["text"]]
+    media = [part for part in parts if part["media_id"]]
+    if len(media) == 1:
+        await send_survey_media(media[0]["media_type"], media[0]["media_id"], None, bot)
+    elif media:
+        await bot.send_media_group(
+            survey_id,
+            [
+                MEDIA_GROUP_TYPES[part["media_type"]](media=part["media_id"])
+                for part in media
+            ],
         )
-    if not media:
-        return
-    if len(media) > 3 and sender:
+    text = edit_text("\n\n".join(texts), str(sender), username)
+    await send_survey(text, bot, alongside=reply(bot, sender))
+
+
+async def deliver(rows: list[Outbox], bot: Bot) -> Survey | None:
+    """Forward one assembled submission with a single header and reply.
+
+    Returns the survey to archive, or None if it was rejected.
+    """
+    parts: list[MsgDict] = [json.loads(row.payload) for row in rows]
+    sender = rows[0].sender_id
+    username = next((part["sender_username"] for part in parts if part["sender_username"]), None)
+    if sum(1 for part in parts if part["media_id"]) > MEDIA_GROUP_LIMIT:
+        spam_guard.forget(sender)
         await bot.send_message(
             sender,
             "К анкете можно прикрепить не более 3 фото! Пожалуйста, отправьте анкету еще раз.",
         )
+        return None
+    if not await copy_submission(rows, parts, sender, username, bot):
+        await resend_submission(parts, sender, username, bot)
+    logger.debug(f"Survey of {len(parts)} parts processed for {sender}")
+    return Survey(
+        sender_id=sender,
+        username=username,
+        text="\n\n".join(part["text"] for part in parts if part["text"]),
+        media_ids=json.dumps([part["media_id"] for part in parts if part["media_id"]]),
+    )
+
+
+async def deliver_batch(rows: list[Outbox], bot: Bot, done: list[int], archive: list[Survey]):
+    """Deliver one batch. On success its ids and survey are added to done
+    and archive, which the worker commits together.
+    """
+    ids = [row.id for row in rows]
+    sender = rows[0].sender_id
+    try:
+        survey = await deliver(rows, bot)
+    except error.BadRequest as err:
+        await run_db(outbox_done, ids)
+        await process_exception(bot, sender, err)
+        return
+    except Exception as err:
+        attempts = rows[0].attempts + 1
+        if attempts >= OUTBOX_MAX_ATTEMPTS:
+            await run_db(outbox_done, ids)
+            await process_exception(bot, sender, err)
+        else:
+            logger.warning(f"Delivery for {sender} failed, attempt {attempts}: {err}")
+            outbox_retries.inc()
+            await run_db(outbox_retry, ids, 2**attempts)
+        return
+    done.extend(ids)
+    if survey:
+        archive.append(survey)
+
+
+async def outbox_worker(bot: Bot):
+    """Drain the outbox forever. Batches of one sender go out in order."""
+    limit = asyncio.Semaphore(OUTBOX_WORKERS)
+
+    async def deliver_sender(batches: list[list[Outbox]], done: list[int], archive: list[Survey]):
+        async with limit:
+            for rows in batches:
+                try:
+                    await deliver_batch(rows, bot, done, archive)
+                except Exception as err:
+                    # Left in the outbox; later batches of this sender wait for the next pass.
+                    logger.exception(f"Outbox batch {rows[0].batch} failed: {err}")
+                    return
+
+    while True:
+        try:
+            pending = await run_db(outbox_pending, OUTBOX_BATCH, OUTBOX_MAX_ATTEMPTS, SHARD_INDEX, SHARD_COUNT)
+        except Exception as err:
+            logger.exception(err)
+            pending = []
+        if not pending:
+            try:
+                await asyncio.wait_for(outbox_wakeup.wait(), OUTBOX_POLL)
+            except asyncio.TimeoutError:
+                pass
+            outbox_wakeup.clear()
+            continue
+        by_sender: dict[int, list[list[Outbox]]] = {}
+        for rows in pending:
+            by_sender.setdefault(rows[0].sender_id, []).append(rows)
+        done: list[int] = []
+        archive: list[Survey] = []
+        await asyncio.gather(*(deliver_sender(batches, done, archive) for batches in by_sender.values()))
+        if done:
+            try:
+                await run_db(outbox_complete, done, archive)
+            except Exception as err:
+                logger.exception(err)
+
+
+async def start_outbox(app: Application):
+    resumed = await run_db(outbox_resume, SHARD_INDEX, SHARD_COUNT)
+    if resumed:
+        logger.info(f"Resuming {resumed} undelivered outbox rows")
+    app.bot_data["outbox_task"] = asyncio.create_task(supervise_outbox(app.bot))
+
+
+async def supervise_outbox(bot: Bot):
+    """Run the outbox worker, restarting it if it ever dies."""
+    while True:
+        try:
+            await outbox_worker(bot)
+        except Exception as err:
+            logger.exception(f"Outbox worker died, restarting: {err}")
+            await error_reporter.report(bot, err, None, "Outbox worker died")
+            await asyncio.sleep(OUTBOX_POLL)
+
+
+async def stop_outbox(app: Application):
+    task = app.bot_data.pop("outbox_task", None)
+    if task:
+        task.cancel()
+
+
+async def flush_submission(context: ContextTypes.DEFAULT_TYPE):
+    sender, batch = context.job.data
+    sub = submissions.get(sender)
+    if sub is None or sub["batch"] != batch:
+        return
+    if sub["job"] is context.job:
+        # A one-shot job is gone once it runs, removing it would raise.
+        sub["job"] = None
+    if sub["rejected"] is None:
+        del submissions[sender]
+        await run_db(outbox_mark_ready, batch)
+        outbox_wakeup.set()
+    elif sub["flushed"]:
+        # Tail of an oversized album that was already rejected.
+        del submissions[sender]
+        await run_db(outbox_drop, batch)
     else:
-        await bot.send_media_group(survey_id, media)
-        await send_survey(text, context)
-        await reply(bot, sender)
-        logger.debug(f"Media group processed for {sender}")
+        sub["flushed"] = True
+        # Keep swallowing the rest of the album until it goes quiet.
+        schedule_flush(context, sender, sub, SURVEY_MEDIA_QUIET)
+        await run_db(outbox_drop, batch)
+        spam_guard.forget(sender)
+        await context.bot.send_message(
+            sender,
+            "К анкете можно прикрепить не более 3 фото! Пожалуйста, отправьте анкету еще раз.",
+        )
+
+
+def schedule_flush(context: ContextTypes.DEFAULT_TYPE, sender: int, sub: PendingSubmission, when: float) -> None:
+    if sub["job"]:
+        sub["job"].schedule_removal()
+    sub["job"] = context.job_queue.run_once(flush_submission, when=when, data=(sender, sub["batch"]))
+
+
+async def add_part(msg_dict: MsgDict, media_group_id: str | None, context: ContextTypes.DEFAULT_TYPE):
+    """Add a survey part to the sender's open submission and push back its
+    flush until the sender goes quiet.
+    """
+    sender = msg_dict["sender_id"]
+    now = time.monotonic()
+    sub = submissions.get(sender)
+    if sub and sub["rejected"] is not None:
+        if not sub["flushed"]:
+            # The rejection notice is about to go out and asks to resend.
+            return
+        if media_group_id and media_group_id == sub["rejected"]:
+            schedule_flush(context, sender, sub, SURVEY_MEDIA_QUIET)
+            return
+        if sub["job"]:
+            sub["job"].schedule_removal()
+        sub = None
+    if sub is None:
+        sub = {
+            "batch": f"{sender}:{msg_dict['message_id']}",
+            "media": 0,
+            "job": None,
+            "deadline": now + SURVEY_MAX_WAIT,
+            "rejected": None,
+            "flushed": False,
+        }
+        submissions[sender] = sub
+    if msg_dict["media_id"]:
+        sub["media"] += 1
+        if sub["media"] > MEDIA_GROUP_LIMIT:
+            sub["rejected"] = media_group_id or ""
+            schedule_flush(context, sender, sub, 0)
+            return
+    quiet = SURVEY_MEDIA_QUIET if msg_dict["media_id"] else SURVEY_PART_QUIET
+    schedule_flush(context, sender, sub, max(0, min(quiet, sub["deadline"] - now)))
+    batch = sub["batch"]
+    await run_db(outbox_add, batch, "part", sender, msg_dict, False)
+    if sub["rejected"] is not None:
+        await run_db(outbox_drop, batch)
+    elif submissions.get(sender) is not sub:
+        # Flushed while the row was written, send it on its own.
+        await run_db(outbox_mark_ready, batch)
+        outbox_wakeup.set()
 
 
 async def unban_info(bot: Bot, id: int):
@@ -167,15 +562,33 @@ async def unban_info(bot: Bot, id: int):
     await bot.send_message(id, text)
 
 
-async def receive_survey(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if check(update.message.from_user.id):
-        await context.bot.send_message(update.effective_chat.id, "вы находитесь в черном списке.")
+async def guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Drop floods and re-sent surveys before any other handler runs."""
+    chat_id = update.effective_chat.id
+    reason = spam_guard.check(chat_id, update.effective_message)
+    if reason is None:
         return
-    text = edit_text(update.message.text, update.effective_chat.id, update.effective_sender.username)
+    logger.debug(f"Dropped {reason} message from {chat_id}")
+    if spam_guard.should_notify(chat_id):
+        await context.bot.send_message(chat_id, GUARD_NOTICES[reason])
+    raise ApplicationHandlerStop
+
+
+async def banned_notice(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await context.bot.send_message(update.effective_chat.id, "вы находитесь в черном списке.")
+
+
+async def receive_survey(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    msg_dict: MsgDict = {
+        "text": update.message.text,
+        "media_type": None,
+        "media_id": None,
+        "message_id": update.message.message_id,
+        "sender_id": update.effective_chat.id,
+        "sender_username": update.effective_sender.username,
+    }
     try:
-        await send_survey(text, context)
-        await reply(context.bot, update.effective_chat.id)
-        logger.debug(f"Text processed for {update.effective_chat.id}")
+        await add_part(msg_dict, None, context)
     except Exception as err:
         await process_exception(context.bot, update.effective_chat.id, err)
 
@@ -185,100 +598,220 @@ async def image(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     if update.message.caption and "unban_request" in update.message.caption:
         return
-    if check(update.message.from_user.id):
-        await context.bot.send_message(update.effective_chat.id, "вы находитесь в черном списке.")
-        return
     message: Message = update.effective_message
     try:
-        if not message.media_group_id:
-            text = update.message.caption
-            text = edit_text(text or "", update.effective_chat.id, update.effective_sender.username)
-            if update.message.video:
-                media = update.message.video
-            elif update.message.photo:
-                media = update.message.photo[-1]
-            else:
-                await context.bot.send_message(update.effective_chat.id, "Поддерживается отправка только картинок и видео.")
-                logger.warning(f"Unsupported media type from {update.effective_chat.id}")
-                return
-            await send_survey_media(media, text, context)
-            await reply(context.bot, update.effective_chat.id)
-            logger.debug(f"Image or video processed for {update.effective_chat.id}")
-        elif (message.photo or message.video) and message.media_group_id:
-            media_type = effective_message_type(message)
-            if message.photo:
-                media_id = message.photo[-1].file_id
-            elif message.video:
-                media_id = message.video.file_id
-            msg_dict = {
-                "media_type": media_type,
-                "media_id": media_id,
-                "caption": message.caption,
-                "message_id": message.message_id,
-                "sender_id": update.effective_chat.id,
-                "sender_username": update.effective_sender.username,
-            }
-            jobs = context.job_queue.get_jobs_by_name(str(message.media_group_id))
-            if jobs:
-                jobs[0].data.append(msg_dict)
-            else:
-                context.job_queue.run_once(
-                    callback=send_survey_media_group,
-                    when=30,
-                    data=[msg_dict],
-                    name=str(message.media_group_id),
-                )
-    except error.BadRequest as err:
-        if "Message caption is too long" in err.message:
-            await context.bot.send_message(
-                update.effective_chat.id,
-                "Пожалуйста, отправьте картинки отдельным сообщением!"
-                "Если картинки и не было, то свяжитесь с админинстрацией. Простите!",
-            )
-            logger.error(f"Message too long from {update.effective_chat.id}")
+        if message.video:
+            media_type, media_id = "video", message.video.file_id
+        elif message.photo:
+            media_type, media_id = "photo", message.photo[-1].file_id
+        elif not message.media_group_id:
+            await context.bot.send_message(update.effective_chat.id, "Поддерживается отправка только картинок и видео.")
+            logger.warning(f"Unsupported media type from {update.effective_chat.id}")
+            return
+        else:
+            return
+        msg_dict: MsgDict = {
+            "text": message.caption,
+            "media_type": media_type,
+            "media_id": media_id,
+            "message_id": message.message_id,
+            "sender_id": update.effective_chat.id,
+            "sender_username": update.effective_sender.username,
+        }
+        await add_part(msg_dict, str(message.media_group_id) if message.media_group_id else None, context)
     except Exception as err:
         await process_exception(context.bot, update.effective_chat.id, err)
 
 
+def parse_users(rows: list[list[str]]) -> tuple[list[tuple[int, str | None]], int]:
+    """(chat_id, username) pairs from rows of id and optional username.
+
+    Returns the pairs and the number of rows with an invalid id.
+    """
+    users = []
+    invalid = 0
+    for n, row in enumerate(rows):
+        if not row or not row[0].strip():
+            continue
+        try:
+            chat_id = int(row[0].strip())
+        except ValueError:
+            # A CSV header is not an error.
+            if n > 0:
+                invalid += 1
+            continue
+        username = row[1].strip() if len(row) > 1 and row[1].strip() else None
+        users.append((chat_id, username))
+    return users, invalid
+
+
+def command_ids(args: list[str]) -> list[list[str]]:
+    """Ids given to /ban or /unban, separated by spaces or commas."""
+    return [[value] for arg in args for value in arg.split(",") if value]
+
+
+async def apply_bulk(action: str, rows: list[list[str]], context: ContextTypes.DEFAULT_TYPE):
+    users, invalid = parse_users(rows)
+    if action == "ban":
+        res = await run_db(bulk_ban, users)
+        verb = "Забанено"
+    else:
+        res = await run_db(bulk_unban, [chat_id for chat_id, _ in users])
+        verb = "Разбанено"
+    logger.info(f"Bulk {action}: {res.applied} applied, {res.skipped} skipped, {invalid} invalid")
+    await context.bot.send_message(
+        survey_id,
+        f"{verb}: {res.applied}, пропущено: {res.skipped + invalid} (неверных id: {invalid})",
+    )
+
+
+async def bulk_from_csv(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat.id != int(survey_id):
+        return
+    action = "unban" if update.message.caption.startswith("/unban") else "ban"
+    file = await update.message.document.get_file()
+    data = await file.download_as_bytearray()
+    rows = list(csv.reader(io.StringIO(data.decode("utf-8-sig"))))
+    await apply_bulk(action, rows, context)
+
+
+async def export_bans(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat.id != int(survey_id):
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bans.csv")
+        count = await run_db(export_bans_csv, path)
+        with open(path, "rb") as f:
+            await context.bot.send_document(survey_id, f, filename="bans.csv", caption=f"Банов: {count}")
+
+
+async def find_page(query: str, key: int, page: int):
+    """Text and pager keyboard for one page of /find results."""
+    hits = await run_db(find_surveys, query, FIND_PAGE_SIZE + 1, page * FIND_PAGE_SIZE)
+    if not hits:
+        return f"По запросу «{query}» ничего не найдено.", None
+    text = f"Анкеты по запросу «{query}», стр. {page + 1}:\n\n"
+    for hit in hits[:FIND_PAGE_SIZE]:
+        date = time.strftime("%d.%m.%Y", time.localtime(hit.created))
+        text += f"#анкета{hit.sender_id} {hit.username or ''} {date}\n{hit.snippet}\n\n"
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀ Назад", callback_data=f"find_{key}_{page - 1}"))
+    if len(hits) > FIND_PAGE_SIZE:
+        buttons.append(InlineKeyboardButton("Далее ▶", callback_data=f"find_{key}_{page + 1}"))
+    return split_message(text)[0], InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+async def find(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat.id != int(survey_id):
+        return
+    query = " ".join(context.args)
+    if not query:
+        await context.bot.send_message(survey_id, "Укажите, что искать: /find текст")
+        return
+    # Queries are kept per chat, callback data only carries their key.
+    queries = context.chat_data.setdefault("find_queries", OrderedDict())
+    key = context.chat_data.get("find_key", 0) + 1
+    context.chat_data["find_key"] = key
+    queries[key] = query
+    if len(queries) > FIND_QUERIES_KEPT:
+        queries.popitem(last=False)
+    text, markup = await find_page(query, key, 0)
+    await context.bot.send_message(survey_id, text, reply_markup=markup)
+
+
+async def find_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer()
+    _, key, page = update.callback_query.data.split("_")
+    query = context.chat_data.get("find_queries", {}).get(int(key))
+    if query is None:
+        await update.callback_query.edit_message_reply_markup(None)
+        return
+    text, markup = await find_page(query, int(key), int(page))
+    await update.callback_query.edit_message_text(text, reply_markup=markup)
+
+
 async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat.id != int(survey_id):
         return
-    if not context.args[0]:
+    if not context.args:
         await context.bot.send_message(survey_id, "Укажите id юзера для бана")
         return
+    if len(context.args) > 1 or "," in context.args[0]:
+        await apply_bulk("ban", command_ids(context.args), context)
+        return
     try:
         res = int(context.args[0])
     except ValueError:
         await context.bot.send_message(survey_id, "id должно быть числом")
         return
-    if ban(res):
+    if await ban_async(res):
         await context.bot.send_message(survey_id, f"Юзер {int(context.args[0])} забанен")
         await unban_info(context.bot, res)
     else:
         await context.bot.send_message(survey_id, f"Ошибка бана {int(context.args[0])}")
 
 
+async def bans_page(flt: str, after: int | None = None, before: int | None = None):
+    """Text and pager keyboard for one page of the ban list."""
+    tried = BAN_FILTERS[flt]
+    # One extra row tells whether there is a page beyond this one.
+    rows = await banlist_page_async(BANS_PAGE_SIZE + 1, after, before, tried)
+    if before is not None:
+        has_prev, has_next = len(rows) > BANS_PAGE_SIZE, True
+        rows = rows[-BANS_PAGE_SIZE:]
+    else:
+        has_prev, has_next = after is not None, len(rows) > BANS_PAGE_SIZE
+        rows = rows[:BANS_PAGE_SIZE]
+    if not rows:
+        return "Список забаненных юзеров пуст.", None
+    text = 'Список забаненных юзеров:\n'
+    for i in rows:
+        text += f"{i.chat_id} | {i.username} | tried unban: {i.tried_unban}\n"
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("◀ Назад", callback_data=f"bans_{flt}_prev_{rows[0].no}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Далее ▶", callback_data=f"bans_{flt}_next_{rows[-1].no}"))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+
 async def view_bans(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat.id != int(survey_id):
         return
-    text = 'Список забаненных юзеров:\n'
-    for i in banlist():
-        text += f"{i.chat_id} | {i.username} | tried unban: {i.tried_unban}\n"
-    await context.bot.send_message(survey_id, text)
+    flt = context.args[0] if context.args else "all"
+    if flt not in BAN_FILTERS:
+        await context.bot.send_message(survey_id, "Фильтр: all, tried или untried")
+        return
+    text, markup = await bans_page(flt)
+    await context.bot.send_message(survey_id, text, reply_markup=markup)
+
+
+async def view_bans_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.callback_query.answer()
+    _, flt, direction, no = update.callback_query.data.split("_")
+    if direction == "next":
+        text, markup = await bans_page(flt, after=int(no))
+    else:
+        text, markup = await bans_page(flt, before=int(no))
+    await update.callback_query.edit_message_text(text, reply_markup=markup)
 
 
 async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat.id != int(survey_id):
         return
-    if not context.args[0]:
+    if not context.args:
         await context.bot.send_message(survey_id, "Укажите id юзера для разбана")
         return
+    if len(context.args) > 1 or "," in context.args[0]:
+        await apply_bulk("unban", command_ids(context.args), context)
+        return
     try:
         res = int(context.args[0])
     except ValueError:
         await context.bot.send_message(survey_id, "id должно быть числом")
         return
-    if unban(res):
+    if await unban_async(res):
         await context.bot.send_message(survey_id, f"Юзер {int(context.args[0])} разбанен")
     else:
         await context.bot.send_message(survey_id, f"Ошибка разбана {int(context.args[0])}")
@@ -306,7 +839,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def user_banned_in_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.chat_member.new_chat_member.status == "kicked":
         logger.info(f"User {update.chat_member.new_chat_member.user.id} banned in main chat")
-        if ban(update.chat_member.new_chat_member.user.id, update.chat_member.new_chat_member.user.username):
+        if await ban_async(update.chat_member.new_chat_member.user.id, update.chat_member.new_chat_member.user.username):
             await context.bot.send_message(
                 survey_id,
                 f"Юзер {update.chat_member.new_chat_member.user.id} {update.chat_member.new_chat_member.user.username} забанен 😎",
@@ -320,67 +853,255 @@ async def user_banned_in_main(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 
 async def unban_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    def buttons(id: str):
+    def buttons(id: str, request_id: int):
         keyboard = [
             [
-                InlineKeyboardButton("Принять", callback_data=f"unban_accept_{id}"),
-                InlineKeyboardButton("Отклонить", callback_data=f"unban_reject_{id}"),
+                InlineKeyboardButton("Принять", callback_data=f"unban_accept_{id}_{request_id}"),
+                InlineKeyboardButton("Отклонить", callback_data=f"unban_reject_{id}_{request_id}"),
             ]
         ]
         return InlineKeyboardMarkup(keyboard)
 
-    if not check(update.effective_chat.id):
+    status = ban_status(update.effective_chat.id)
+    if not status.banned:
         return
-    if check_unbans(update.effective_chat.id):
+    request_id = None if status.tried_unban else await request_unban_async(update.effective_chat.id)
+    if request_id is None:
         await context.bot.send_message(update.effective_chat.id, "Вы уже использовали запрос на разбан.")
         return
-    user_tried_unban(update.effective_chat.id)
     req_text = update.effective_message.text.replace("/unban_request", "")
-    if len(req_text) > 1900:
-        req_text = req_text[:1900]
+    req_text = split_message(req_text, limit=MESSAGE_LIMIT - 200)[0] if req_text.strip() else ""
     text = f"Unban request from user: {update.effective_message.from_user.id} {update.effective_message.from_user.username}\n{req_text}"
-    await context.bot.send_message(unbanner, text, reply_markup=buttons(str(update.effective_message.from_user.id)))
+    await context.bot.send_message(
+        unbanner, text, reply_markup=buttons(str(update.effective_message.from_user.id), request_id)
+    )
+
+
+async def show_unban_decision(query: CallbackQuery, decision: UnbanDecision):
+    """Mark the request message with the decision and remove its buttons."""
+    text = getattr(query.message, "text", None) or ""
+    status = UNBAN_STATUS_TEXT.get(decision.status, decision.status)
+    try:
+        await query.edit_message_text(f"{text}\n\n{status}: {decision.decided_by or '-'}", reply_markup=None)
+    except error.BadRequest as err:
+        # Already edited by an earlier press.
+        logger.debug(f"Unban request message not edited: {err}")
 
 
 async def unban_request_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.callback_query.answer()
-    _, decision, user_id = update.callback_query.data.split("_")
-    match decision:
-        case "accept":
-            unban(int(user_id))
-            await context.bot.send_message(
-                int(user_id),
-                "Ваша заявка получена! Бан был аннулирован! Вы можете пользоваться анкетологом, вскоре мы добавим вас в инфо-канал.",
-            )
-        case "reject":
-            await context.bot.send_message(int(user_id), "Ваша заявка была отклонена!")
+    query = update.callback_query
+    # unban_{decision}_{user_id}_{request_id}; buttons sent before requests
+    # were stored have no request id.
+    _, decision, user_id, *rest = query.data.split("_")
+    chat_id, request_id = int(user_id), int(rest[0]) if rest else None
+    known = unban_decisions.get((chat_id, request_id))
+    if known:
+        await query.answer(f"Заявка уже рассмотрена: {UNBAN_STATUS_TEXT.get(known.status, known.status)}")
+        return
+    admin = query.from_user.username or query.from_user.full_name
+    result = await decide_unban_async(chat_id, request_id, decision == "accept", admin)
+    unban_decisions.set((chat_id, request_id), result)
+    if not result.decided:
+        await query.answer(f"Заявка уже рассмотрена: {UNBAN_STATUS_TEXT.get(result.status, result.status)}")
+        await show_unban_decision(query, result)
+        return
+    await query.answer()
+    await show_unban_decision(query, result)
+    if result.status == "accepted":
+        await context.bot.send_message(
+            chat_id,
+            "Ваша заявка получена! Бан был аннулирован! Вы можете пользоваться анкетологом, вскоре мы добавим вас в инфо-канал.",
+        )
+    else:
+        await context.bot.send_message(chat_id, "Ваша заявка была отклонена!")
 
 
-def main() -> None:
-    create_tables()
-    app = (
-        Application.builder().token(os.getenv("TOKEN")).write_timeout(30).media_write_timeout(100).read_timeout(30).build()
-    )  # type: ignore
-    app.add_handler(ChatMemberHandler(user_banned_in_main, chat_member_types=ChatMemberHandler.CHAT_MEMBER, chat_id=main_chat))
-    app.add_handler(CommandHandler("ban", ban_user))
-    app.add_handler(CommandHandler("unban_request", unban_request))
-    app.add_handler(CommandHandler("unban", unban_user))
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("survey", receive_survey))
-    app.add_handler(CommandHandler("answer", answer_back))
+async def run_broadcast(bot: Bot, broadcast_id: int, text: str):
+    """Send a broadcast until no target is pending, then report the counts.
+
+    Outcomes are stored per chunk, so an interrupted broadcast resumes where
+    it stopped. Only the chunk in flight can be sent twice.
+    """
+    try:
+        while chat_ids := await run_db(broadcast_pending, broadcast_id, BROADCAST_CHUNK):
+            results = await fan_out(bot, chat_ids, text)
+            await run_db(broadcast_mark, broadcast_id, results)
+        counts = await run_db(broadcast_finish, broadcast_id)
+        logger.info(f"Broadcast {broadcast_id} finished: {counts}")
+        await bot.send_message(survey_id, f"Рассылка #{broadcast_id} завершена: " + outcome_text(counts))
+    except Exception as err:
+        logger.exception(err)
+        await error_reporter.report(bot, err, None, f"Error on broadcast {broadcast_id}")
+
+
+def start_broadcast(app: Application, broadcast_id: int, text: str) -> None:
+    tasks: set[asyncio.Task] = app.bot_data.setdefault("broadcasts", set())
+    task = asyncio.create_task(run_broadcast(app.bot, broadcast_id, text))
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+
+
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/broadcast [active] [dd.mm.yyyy] and the text on the next lines.
+
+    active leaves out banned users, a date leaves out users without a
+    survey since then.
+    """
+    if update.effective_chat.id != int(survey_id):
+        return
+    usage = "Формат: /broadcast [active] [дд.мм.гггг]\nтекст рассылки"
+    full_text: str = update.message.text.replace("/broadcast", "", 1)
+    if "\n" not in full_text:
+        await context.bot.send_message(survey_id, usage)
+        return
+    options, text = full_text.split("\n", 1)
+    only_active, since = False, None
+    for option in options.split():
+        if option == "active":
+            only_active = True
+            continue
+        try:
+            since = time.mktime(time.strptime(option, "%d.%m.%Y"))
+        except ValueError:
+            await context.bot.send_message(survey_id, usage)
+            return
+    if not text.strip():
+        await context.bot.send_message(survey_id, usage)
+        return
+    broadcast_id, targets = await run_db(broadcast_create, text, only_active, since)
+    logger.info(f"Broadcast {broadcast_id} started for {targets} users")
+    await context.bot.send_message(survey_id, f"Рассылка #{broadcast_id} запущена, получателей: {targets}")
+    start_broadcast(context.application, broadcast_id, text)
+
+
+async def resume_broadcasts(app: Application):
+    # Only the process handling the surveys chat runs broadcasts.
+    if int(survey_id) % SHARD_COUNT != SHARD_INDEX:
+        return
+    for unfinished in await run_db(broadcast_unfinished):
+        logger.info(f"Resuming broadcast {unfinished.id}")
+        start_broadcast(app, unfinished.id, unfinished.text)
+
+
+async def send_error_digest(context: ContextTypes.DEFAULT_TYPE):
+    await error_reporter.send_digest(context.bot)
+
+
+async def sync_bans(context: ContextTypes.DEFAULT_TYPE):
+    if await run_db(refresh_bans):
+        logger.debug("Ban cache reloaded after a change from another process")
+
+
+async def on_startup(app: Application):
+    await start_outbox(app)
+    await resume_broadcasts(app)
+    app.job_queue.run_repeating(send_error_digest, interval=ERROR_DIGEST_INTERVAL, first=ERROR_DIGEST_INTERVAL)
+    if SHARD_COUNT > 1:
+        app.job_queue.run_repeating(sync_bans, interval=BAN_SYNC_INTERVAL, first=BAN_SYNC_INTERVAL)
+    if metrics.METRICS_PORT:
+        port = int(metrics.METRICS_PORT) + SHARD_INDEX
+        app.bot_data["metrics_server"] = await metrics.start_server(port)
+
+
+async def on_shutdown(app: Application):
+    await stop_outbox(app)
+    for task in app.bot_data.pop("broadcasts", set()):
+        task.cancel()
+    server = app.bot_data.pop("metrics_server", None)
+    if server:
+        server.close()
+
+
+def build_application(token: str | None = None, base_url: str | None = None) -> Application:
+    """Build the bot application with all handlers registered.
+
+    base_url points the bot at another Bot API server, e.g. a local fake one.
+    """
+    builder = (
+        Application.builder()
+        .token(token or os.getenv("TOKEN"))
+        .write_timeout(30)
+        .media_write_timeout(100)
+        .read_timeout(30)
+        .rate_limiter(FloodLimiter(shares=SHARD_COUNT))
+        .concurrent_updates(ChatOrderedProcessor())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    app = builder.build()  # type: ignore
+    # Not timed by metrics.handler, which would count ApplicationHandlerStop as an error.
+    app.add_handler(MessageHandler(filters.ChatType.PRIVATE & filters.UpdateType.MESSAGE, guard), group=-1)
+    app.add_handler(ChatMemberHandler(metrics.handler(user_banned_in_main), chat_member_types=ChatMemberHandler.CHAT_MEMBER, chat_id=main_chat))
+    app.add_handler(CommandHandler("ban", metrics.handler(ban_user)))
+    app.add_handler(CommandHandler("unban_request", metrics.handler(unban_request)))
+    app.add_handler(CommandHandler("unban", metrics.handler(unban_user)))
+    app.add_handler(CommandHandler("start", metrics.handler(start)))
+    # Banned users fall through to banned_notice below.
+    app.add_handler(CommandHandler("survey", metrics.handler(receive_survey), filters=~banned_users))
+    app.add_handler(CommandHandler("answer", metrics.handler(answer_back)))
+    app.add_handler(CommandHandler("view_bans", metrics.handler(view_bans)))
+    app.add_handler(CommandHandler("export_bans", metrics.handler(export_bans)))
+    app.add_handler(CommandHandler("find", metrics.handler(find)))
+    app.add_handler(CommandHandler("broadcast", metrics.handler(broadcast)))
+    app.add_handler(
+        MessageHandler(
+            filters.Chat(int(survey_id))
+            & filters.Document.FileExtension("csv")
+            & filters.CaptionRegex(r"^/(ban|unban)(\s|$)"),
+            metrics.handler(bulk_from_csv),
+        )
+    )
+    app.add_handler(
+        MessageHandler(
+            filters=(banned_users & (~filters.Chat(int(survey_id))) & (~filters.Chat(int(main_chat)))),
+            callback=metrics.handler(banned_notice),
+        )
+    )
     app.add_handler(
         MessageHandler(
             filters=(filters.TEXT & (~filters.Chat(int(survey_id))) & (~filters.Chat(int(main_chat)))),
-            callback=receive_survey,
+            callback=metrics.handler(receive_survey),
         )
     )
     app.add_handler(
         MessageHandler(
-            filters.UpdateType.MESSAGE & (~filters.Chat(int(survey_id))  & (~filters.Chat(int(main_chat)))), image
+            filters.UpdateType.MESSAGE & (~filters.Chat(int(survey_id))  & (~filters.Chat(int(main_chat)))), metrics.handler(image)
         )
     )
-    app.add_handler(CallbackQueryHandler(unban_request_callback))
-    app.run_polling(allowed_updates=Update.ALL_TYPES, timeout=120)
+    app.add_handler(CallbackQueryHandler(metrics.handler(unban_request_callback), pattern="^unban_"))
+    app.add_handler(CallbackQueryHandler(metrics.handler(view_bans_callback), pattern="^bans_"))
+    app.add_handler(CallbackQueryHandler(metrics.handler(find_callback), pattern="^find_"))
+    return app
+
+
+def webhook_options() -> dict | None:
+    """Webhook arguments from the WEBHOOK_* environment, None to use polling."""
+    webhook_url = os.getenv("WEBHOOK_URL")
+    if not webhook_url:
+        return None
+    secret = os.getenv("WEBHOOK_SECRET")
+    if not secret:
+        logger.warning("Webhook mode without WEBHOOK_SECRET, updates are not authenticated")
+    return {
+        "listen": os.getenv("WEBHOOK_LISTEN", "127.0.0.1"),
+        "port": int(os.getenv("WEBHOOK_PORT", "8443")),
+        "url_path": os.getenv("WEBHOOK_PATH", "telegram"),
+        "secret_token": secret,
+        "webhook_url": webhook_url,
+        "allowed_updates": Update.ALL_TYPES,
+    }
+
+
+def main() -> None:
+    create_tables()
+    app = build_application()
+    options = webhook_options()
+    if options:
+        app.run_webhook(**options)
+    else:
+        app.run_polling(allowed_updates=Update.ALL_TYPES, timeout=120)
 
 
 if __name__ == "__main__":
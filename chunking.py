@@ -0,0 +1,48 @@
+MESSAGE_LIMIT = 4096
+# Preferred cut points, best first.
+SEPARATORS = ("\n\n", "\n", " ")
+
+
+def utf16_len(text: str) -> int:
+    """Length as Telegram counts it, in UTF-16 code units."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _fit(text: str, limit: int) -> int:
+    """Number of leading characters of text that fit into limit."""
+    n = min(len(text), limit)
+    while (excess := utf16_len(text[:n]) - limit) > 0:
+        n -= (excess + 1) // 2
+    return n
+
+
+def _cut(text: str, limit: int) -> int:
+    n = _fit(text, limit)
+    if n == len(text):
+        return n
+    for sep in SEPARATORS:
+        i = text.rfind(sep, 0, n)
+        # Do not accept a boundary that leaves a tiny chunk behind,
+        # unless it is the last resort before cutting a word.
+        if i > n // 2 or (sep == " " and i > 0):
+            return i
+    return n
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT, tail: str = "") -> list[str]:
+    """Split text into messages of at most limit, cutting on paragraph,
+    line or word boundaries. A tail ending the text is never split and
+    stays on the last message.
+    """
+    body = text[: len(text) - len(tail)] if tail and text.endswith(tail) else text
+    tail = text[len(body):]
+    chunks = []
+    while utf16_len(body) > limit:
+        i = _cut(body, limit)
+        chunks.append(body[:i].rstrip())
+        body = body[i:].lstrip("\n ")
+    if utf16_len(body + tail) <= limit:
+        chunks.append(body + tail)
+    else:
+        chunks.extend([body, tail.lstrip("\n")])
+    return [chunk for chunk in chunks if chunk.strip()]
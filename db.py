@@ -1,30 +1,203 @@
+import asyncio
+import csv
+import functools
+import json
+import os
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
 
+from sqlalchemy import delete, event, func, inspect, literal, select as sa_select, text as sa_text, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlmodel import SQLModel, create_engine, select, Session, Field
 
 from logs import get_logger
+from metrics import add_time, timed_db
 
 
 logger = get_logger()
-engine = create_engine("sqlite:///banned.db")
+DB_URL = os.getenv("DB_URL", "sqlite:///banned.db")
+engine = create_engine(
+    DB_URL,
+    poolclass=QueuePool,
+    pool_size=int(os.getenv("DB_WORKERS", "4")),
+    max_overflow=0,
+    pool_timeout=30,
+    connect_args={"check_same_thread": False, "timeout": 30},
+)
+# Only used to notice commits made by other processes.
+_watch_engine = create_engine(DB_URL, poolclass=StaticPool, connect_args={"check_same_thread": False})
+_data_version: int | None = None
+_ban_version: int | None = None
+
+
+@event.listens_for(engine, "connect")
+@event.listens_for(_watch_engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """WAL lets several processes read while one writes; writers wait
+    for the lock instead of failing with "database is locked".
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.close()
+
+# SQLite calls are blocking, so async handlers run them on this pool.
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("DB_WORKERS", "4")), thread_name_prefix="db")
+# Max ids per IN (...) clause, well under SQLite's bound parameter limit.
+BULK_CHUNK = 500
+# chat_id -> tried_unban for every banned user, filled by create_tables()
+_bans: dict[int, bool] = {}
 
 
 class Banned(SQLModel, table=True):
     no: int = Field(primary_key=True)
-    chat_id: int
+    chat_id: int = Field(index=True, unique=True)
     username: str | None = None
     tried_unban: bool = False
 
 
+class Outbox(SQLModel, table=True):
+    """A survey part waiting to be forwarded to the surveys chat.
+
+    Rows sharing a batch are delivered together as one submission. A batch
+    is only picked up once ready, i.e. when its sender has gone quiet.
+    """
+
+    id: int | None = Field(default=None, primary_key=True)
+    batch: str = Field(index=True)
+    # "part", or "copied" once copy_messages put the batch in the surveys chat
+    kind: str
+    sender_id: int
+    payload: str
+    ready: bool = False
+    attempts: int = 0
+    not_before: float = 0
+
+
+class Survey(SQLModel, table=True):
+    """A forwarded submission, searchable through the survey_fts index."""
+
+    id: int | None = Field(default=None, primary_key=True)
+    sender_id: int = Field(index=True)
+    username: str | None = None
+    text: str = ""
+    media_ids: str = "[]"
+    created: float = Field(default_factory=time.time, index=True)
+
+
+class UnbanRequest(SQLModel, table=True):
+    """An unban request of a banned user: pending, accepted or rejected."""
+
+    id: int | None = Field(default=None, primary_key=True)
+    chat_id: int = Field(index=True)
+    status: str = "pending"
+    decided_by: str | None = None
+    decided_at: float | None = None
+    created: float = Field(default_factory=time.time)
+
+
+class Broadcast(SQLModel, table=True):
+    """An announcement to past applicants. Unfinished ones are resumed on start."""
+
+    id: int | None = Field(default=None, primary_key=True)
+    text: str
+    created: float = Field(default_factory=time.time)
+    finished: bool = False
+
+
+class BroadcastTarget(SQLModel, table=True):
+    """One recipient of a broadcast: pending, delivered, blocked or failed."""
+
+    broadcast_id: int = Field(primary_key=True)
+    chat_id: int = Field(primary_key=True)
+    status: str = Field(default="pending", index=True)
+
+
+class SurveyHit(NamedTuple):
+    sender_id: int
+    username: str | None
+    created: float
+    snippet: str
+
+
+# Databases created before Banned.chat_id was unique may hold duplicates.
+# Keep the oldest row per chat_id, carrying over tried_unban, then index.
+BANNED_UNIQUE_DDL = (
+    """UPDATE banned SET tried_unban = 1
+    WHERE no IN (SELECT MIN(no) FROM banned GROUP BY chat_id HAVING MAX(tried_unban) = 1)""",
+    "DELETE FROM banned WHERE no NOT IN (SELECT MIN(no) FROM banned GROUP BY chat_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_banned_chat_id ON banned (chat_id)",
+)
+
+
+# A counter bumped by every change to banned, so other processes can tell
+# ban changes from the rest of the writes without reading the table.
+BAN_VERSION_DDL = (
+    "CREATE TABLE IF NOT EXISTS banversion (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO banversion (id, version) VALUES (1, 0)",
+    """CREATE TRIGGER IF NOT EXISTS banned_ai AFTER INSERT ON banned BEGIN
+        UPDATE banversion SET version = version + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS banned_ad AFTER DELETE ON banned BEGIN
+        UPDATE banversion SET version = version + 1;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS banned_au AFTER UPDATE ON banned BEGIN
+        UPDATE banversion SET version = version + 1;
+    END""",
+)
+
+
+# External-content FTS5 index over Survey, kept in sync by triggers.
+SURVEY_FTS_DDL = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS survey_fts USING fts5(
+        text, username, content='survey', content_rowid='id', tokenize='unicode61'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS survey_ai AFTER INSERT ON survey BEGIN
+        INSERT INTO survey_fts(rowid, text, username) VALUES (new.id, new.text, new.username);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS survey_ad AFTER DELETE ON survey BEGIN
+        INSERT INTO survey_fts(survey_fts, rowid, text, username) VALUES ('delete', old.id, old.text, old.username);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS survey_au AFTER UPDATE ON survey BEGIN
+        INSERT INTO survey_fts(survey_fts, rowid, text, username) VALUES ('delete', old.id, old.text, old.username);
+        INSERT INTO survey_fts(rowid, text, username) VALUES (new.id, new.text, new.username);
+    END""",
+)
+
+
+class BanStatus(NamedTuple):
+    banned: bool
+    tried_unban: bool
+
+
+class UnbanDecision(NamedTuple):
+    # False if the request had been decided already, by decided_by.
+    decided: bool
+    status: str
+    decided_by: str | None
+
+
+class BulkResult(NamedTuple):
+    applied: int
+    skipped: int
+
+
+@timed_db
 def ban(chat_id: int, username: str | None = None) -> bool:
     try:
-        query = select(Banned).where(Banned.chat_id == chat_id)
+        query = (
+            insert(Banned)
+            .values(chat_id=chat_id, username=username)
+            .on_conflict_do_nothing(index_elements=["chat_id"])
+        )
         with Session(engine) as s:
-            res = s.exec(query).first()
-            if not res:
-                new = Banned(chat_id=chat_id, username=username)
-                s.add(new)
-                s.commit()
+            s.exec(query)
+            s.commit()
+        _bans.setdefault(chat_id, False)
         return True
     except Exception as err:
         logger.error(f"Ошибка бана: {err}")
@@ -32,51 +205,427 @@ def ban(chat_id: int, username: str | None = None) -> bool:
         return False
 
 
+@timed_db
 def unban(chat_id: int) -> bool:
     try:
-        query = select(Banned).where(Banned.chat_id == chat_id)
+        query = delete(Banned).where(Banned.chat_id == chat_id)
         with Session(engine) as s:
-            res = s.exec(query).first()
-            if res:
-                s.delete(res)
-                s.commit()
-                return True
+            res = s.exec(query)
+            s.commit()
+        _bans.pop(chat_id, None)
+        return res.rowcount > 0
     except Exception as err:
         logger.error(f"Ошибка разбана: {err}")
         return False
 
 
+def ban_status(chat_id: int) -> BanStatus:
+    """Full ban status from the cache, no database round-trip."""
+    tried_unban = _bans.get(chat_id)
+    return BanStatus(tried_unban is not None, bool(tried_unban))
+
+
 def check(chat_id: int) -> bool:
-    query = select(Banned).where(Banned.chat_id == chat_id)
+    return ban_status(chat_id).banned
+
+
+@timed_db
+def request_unban(chat_id: int) -> int | None:
+    """Atomically use up the single unban request of a banned user.
+
+    Returns the id of the stored request, or None if the user is not
+    banned or has already asked.
+    """
+    query = (
+        update(Banned)
+        .where(Banned.chat_id == chat_id, Banned.tried_unban == False)  # noqa: E712
+        .values(tried_unban=True)
+    )
+    request_id = None
     with Session(engine) as s:
-        res = s.exec(query).first()
-    return res is not None
+        res = s.exec(query)
+        if res.rowcount == 1:
+            request = UnbanRequest(chat_id=chat_id)
+            s.add(request)
+            s.flush()
+            request_id = request.id
+        s.commit()
+    if chat_id in _bans:
+        _bans[chat_id] = True
+    return request_id
+
 
-def check_unbans(chat_id: int) -> bool:
-    query = select(Banned).where(Banned.chat_id == chat_id)
+@timed_db
+def decide_unban(chat_id: int, request_id: int | None, accept: bool, admin: str) -> UnbanDecision:
+    """Accept or reject an unban request exactly once.
+
+    The first decision leaves pending and, on accept, lifts the ban in the
+    same transaction. Later ones change nothing and get the first decision
+    back. Without request_id (buttons sent before requests were stored)
+    the chat's latest request is used, created if there is none.
+    """
+    status = "accepted" if accept else "rejected"
     with Session(engine) as s:
-        res = s.exec(query).first()
-    if res:
-        return res.tried_unban
-    return False
+        if request_id is None:
+            latest = select(UnbanRequest.id).where(UnbanRequest.chat_id == chat_id).order_by(UnbanRequest.id.desc())
+            request_id = s.exec(latest.limit(1)).first()
+            if request_id is None:
+                request = UnbanRequest(chat_id=chat_id)
+                s.add(request)
+                s.flush()
+                request_id = request.id
+        res = s.exec(
+            update(UnbanRequest)
+            .where(UnbanRequest.id == request_id, UnbanRequest.chat_id == chat_id, UnbanRequest.status == "pending")
+            .values(status=status, decided_by=admin, decided_at=time.time())
+        )
+        decided = res.rowcount == 1
+        if decided and accept:
+            s.exec(delete(Banned).where(Banned.chat_id == chat_id))
+        request = s.get(UnbanRequest, request_id)
+        s.commit()
+        result = UnbanDecision(decided, request.status if request else status, request.decided_by if request else None)
+    if decided and accept:
+        _bans.pop(chat_id, None)
+    return result
 
 
-def user_tried_unban(chat_id: int) -> None:
-    query = select(Banned).where(Banned.chat_id == chat_id)
+@timed_db
+def bulk_ban(users: list[tuple[int, str | None]]) -> BulkResult:
+    """Ban many users in one transaction. Already banned ones are skipped."""
+    unique: dict[int, str | None] = {}
+    for chat_id, username in users:
+        unique.setdefault(chat_id, username)
+    ids = list(unique)
     with Session(engine) as s:
-        res = s.exec(query).first()
-        if res:
-            res.tried_unban = True
-            s.add(res)
-            s.commit()
+        existing = set()
+        for i in range(0, len(ids), BULK_CHUNK):
+            existing.update(s.exec(select(Banned.chat_id).where(Banned.chat_id.in_(ids[i:i + BULK_CHUNK]))).all())
+        new = [{"chat_id": chat_id, "username": username} for chat_id, username in unique.items() if chat_id not in existing]
+        if new:
+            s.exec(insert(Banned).on_conflict_do_nothing(index_elements=["chat_id"]), params=new)
+        s.commit()
+    for row in new:
+        _bans.setdefault(row["chat_id"], False)
+    return BulkResult(len(new), len(users) - len(new))
+
+
+@timed_db
+def bulk_unban(chat_ids: list[int]) -> BulkResult:
+    """Unban many users in one transaction. Users not banned are skipped."""
+    ids = list(dict.fromkeys(chat_ids))
+    removed = 0
+    with Session(engine) as s:
+        for i in range(0, len(ids), BULK_CHUNK):
+            res = s.exec(delete(Banned).where(Banned.chat_id.in_(ids[i:i + BULK_CHUNK])))
+            removed += res.rowcount
+        s.commit()
+    for chat_id in ids:
+        _bans.pop(chat_id, None)
+    return BulkResult(removed, len(chat_ids) - removed)
+
+
+@timed_db
+def export_bans_csv(path: str) -> int:
+    """Stream all bans into a CSV file. Returns the number of rows."""
+    count = 0
+    query = select(Banned).order_by(Banned.no).execution_options(yield_per=BULK_CHUNK)
+    with open(path, "w", newline="", encoding="utf-8") as f, Session(engine) as s:
+        writer = csv.writer(f)
+        writer.writerow(["chat_id", "username", "tried_unban"])
+        for row in s.exec(query):
+            writer.writerow([row.chat_id, row.username or "", int(row.tried_unban)])
+            count += 1
+    return count
+
+
+@timed_db
+def banlist_page(
+    limit: int, after: int | None = None, before: int | None = None, tried_unban: bool | None = None
+) -> list[Banned]:
+    """One page of bans ordered by Banned.no, seeking past after or before."""
+    query = select(Banned)
+    if tried_unban is not None:
+        query = query.where(Banned.tried_unban == tried_unban)
+    if before is not None:
+        query = query.where(Banned.no < before).order_by(Banned.no.desc())
+    else:
+        if after is not None:
+            query = query.where(Banned.no > after)
+        query = query.order_by(Banned.no)
+    with Session(engine) as s:
+        res = s.exec(query.limit(limit)).all()
+    return sorted(res, key=lambda row: row.no)
+
+
+@timed_db
+def outbox_add(batch: str, kind: str, sender_id: int, payload: dict, ready: bool = True) -> None:
+    with Session(engine) as s:
+        s.add(Outbox(batch=batch, kind=kind, sender_id=sender_id, payload=json.dumps(payload), ready=ready))
+        s.commit()
+
+
+@timed_db
+def outbox_mark_ready(batch: str) -> None:
+    with Session(engine) as s:
+        s.exec(update(Outbox).where(Outbox.batch == batch).values(ready=True))
+        s.commit()
+
+
+@timed_db
+def outbox_mark_copied(ids: list[int]) -> None:
+    """Record that the rows were copied, so a retry only sends the header."""
+    with Session(engine) as s:
+        s.exec(update(Outbox).where(Outbox.id.in_(ids)).values(kind="copied"))
+        s.commit()
+
+
+@timed_db
+def outbox_drop(batch: str) -> None:
+    with Session(engine) as s:
+        s.exec(delete(Outbox).where(Outbox.batch == batch))
+        s.commit()
+
+
+@timed_db
+def outbox_resume(shard: int = 0, shards: int = 1) -> int:
+    """Release batches left incomplete by a restart of this shard. Returns
+    their row count.
+    """
+    conditions = [Outbox.ready == False]  # noqa: E712
+    if shards > 1:
+        conditions.append(Outbox.sender_id % shards == shard)
+    with Session(engine) as s:
+        res = s.exec(update(Outbox).where(*conditions).values(ready=True))
+        s.commit()
+    return res.rowcount
+
+
+@timed_db
+def outbox_pending(limit: int, max_attempts: int, shard: int = 0, shards: int = 1) -> list[list[Outbox]]:
+    """Up to limit ready batches, oldest first, each as its list of rows.
+
+    With several worker processes each one only drains the senders of its
+    own shard, the same split the updates are routed by.
+    """
+    conditions = [Outbox.ready == True, Outbox.attempts < max_attempts, Outbox.not_before <= time.time()]  # noqa: E712
+    if shards > 1:
+        conditions.append(Outbox.sender_id % shards == shard)
+    batches = select(Outbox.batch).where(*conditions).group_by(Outbox.batch).order_by(func.min(Outbox.id)).limit(limit)
+    with Session(engine) as s:
+        names = s.exec(batches).all()
+        rows = s.exec(select(Outbox).where(Outbox.batch.in_(names)).order_by(Outbox.id)).all()
+    grouped: dict[str, list[Outbox]] = {name: [] for name in names}
+    for row in rows:
+        grouped[row.batch].append(row)
+    return list(grouped.values())
+
+
+@timed_db
+def outbox_done(ids: list[int]) -> None:
+    with Session(engine) as s:
+        s.exec(delete(Outbox).where(Outbox.id.in_(ids)))
+        s.commit()
+
+
+@timed_db
+def outbox_complete(ids: list[int], surveys: list[Survey]) -> None:
+    """Remove delivered rows and archive their surveys in one transaction."""
+    with Session(engine) as s:
+        s.exec(delete(Outbox).where(Outbox.id.in_(ids)))
+        s.add_all(surveys)
+        s.commit()
+
+
+def fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query matching all words, as prefixes."""
+    words = text.replace('"', " ").split()
+    return " ".join(f'"{word}"*' for word in words)
+
+
+@timed_db
+def find_surveys(text: str, limit: int, offset: int = 0) -> list[SurveyHit]:
+    """Surveys matching all words of text, best match first."""
+    query = fts_query(text)
+    if not query:
+        return []
+    sql = sa_text(
+        """
+        SELECT survey.sender_id, survey.username, survey.created,
+               snippet(survey_fts, 0, '«', '»', '…', 16)
+        FROM survey_fts JOIN survey ON survey.id = survey_fts.rowid
+        WHERE survey_fts MATCH :query
+        ORDER BY rank
+        LIMIT :limit OFFSET :offset
+        """
+    )
+    with Session(engine) as s:
+        rows = s.connection().execute(sql, {"query": query, "limit": limit, "offset": offset}).all()
+    return [SurveyHit(*row) for row in rows]
+
+
+@timed_db
+def outbox_retry(ids: list[int], delay: float) -> None:
+    with Session(engine) as s:
+        s.exec(
+            update(Outbox)
+            .where(Outbox.id.in_(ids))
+            .values(attempts=Outbox.attempts + 1, not_before=time.time() + delay)
+        )
+        s.commit()
+
+
+@timed_db
+def broadcast_create(text: str, only_active: bool = False, since: float | None = None) -> tuple[int, int]:
+    """Store a broadcast with every past applicant as a target.
+
+    only_active leaves out banned users, since leaves out users whose last
+    survey is older. Returns the broadcast id and the number of targets.
+    """
+    with Session(engine) as s:
+        broadcast = Broadcast(text=text)
+        s.add(broadcast)
+        s.flush()
+        senders = sa_select(literal(broadcast.id), Survey.sender_id).distinct()
+        if since is not None:
+            senders = senders.where(Survey.created >= since)
+        if only_active:
+            senders = senders.where(Survey.sender_id.not_in(sa_select(Banned.chat_id)))
+        res = s.exec(insert(BroadcastTarget).from_select(["broadcast_id", "chat_id"], senders))
+        s.commit()
+        return broadcast.id, res.rowcount
+
+
+@timed_db
+def broadcast_pending(broadcast_id: int, limit: int) -> list[int]:
+    query = (
+        select(BroadcastTarget.chat_id)
+        .where(BroadcastTarget.broadcast_id == broadcast_id, BroadcastTarget.status == "pending")
+        .limit(limit)
+    )
+    with Session(engine) as s:
+        return list(s.exec(query).all())
+
+
+@timed_db
+def broadcast_mark(broadcast_id: int, results: dict[int, str]) -> None:
+    """Record the outcome of each chat, one UPDATE per status."""
+    by_status: dict[str, list[int]] = {}
+    for chat_id, status in results.items():
+        by_status.setdefault(status, []).append(chat_id)
+    with Session(engine) as s:
+        for status, ids in by_status.items():
+            s.exec(
+                update(BroadcastTarget)
+                .where(BroadcastTarget.broadcast_id == broadcast_id, BroadcastTarget.chat_id.in_(ids))
+                .values(status=status)
+            )
+        s.commit()
+
+
+@timed_db
+def broadcast_finish(broadcast_id: int) -> dict[str, int]:
+    """Mark a broadcast finished. Returns its target count per status."""
+    query = (
+        select(BroadcastTarget.status, func.count())
+        .where(BroadcastTarget.broadcast_id == broadcast_id)
+        .group_by(BroadcastTarget.status)
+    )
+    with Session(engine) as s:
+        s.exec(update(Broadcast).where(Broadcast.id == broadcast_id).values(finished=True))
+        counts = dict(s.exec(query).all())
+        s.commit()
+    return counts
 
 
-def banlist() -> list[Banned]:
+@timed_db
+def broadcast_unfinished() -> list[Broadcast]:
     with Session(engine) as s:
-        res = s.exec(select(Banned)).all()
-    return res
+        return list(s.exec(select(Broadcast).where(Broadcast.finished == False)).all())  # noqa: E712
+
+
+@timed_db
+def load_bans() -> None:
+    """Fill the in-memory ban cache from the database."""
+    global _bans
+    with Session(engine) as s:
+        rows = s.exec(select(Banned.chat_id, Banned.tried_unban)).all()
+    # Swap in a new dict so readers never see a half-filled cache.
+    _bans = dict(rows)
+    logger.info(f"Loaded {len(_bans)} bans into cache")
+
+
+@timed_db
+def refresh_bans() -> bool:
+    """Reload the ban cache if another connection changed banned since the
+    last call, e.g. a ban made by another worker process. Returns True if
+    reloaded.
+
+    PRAGMA data_version moves on any commit, outbox writes included, so
+    only the ban counter decides whether the table is read again.
+    """
+    global _data_version, _ban_version
+    with _watch_engine.connect() as conn:
+        version = conn.exec_driver_sql("PRAGMA data_version").scalar()
+        if version == _data_version:
+            return False
+        _data_version = version
+        ban_version = conn.exec_driver_sql("SELECT version FROM banversion").scalar()
+    if ban_version == _ban_version:
+        return False
+    _ban_version = ban_version
+    load_bans()
+    return True
 
 
+@timed_db
 def create_tables() -> None:
     """Created baseline tables if they do not exist already."""
-    SQLModel.metadata.create_all(engine)
\ No newline at end of file
+    SQLModel.metadata.create_all(engine)
+    with engine.begin() as conn:
+        unique = any(
+            index["unique"] and index["column_names"] == ["chat_id"] for index in inspect(conn).get_indexes("banned")
+        )
+        if not unique:
+            logger.info("Adding the unique index on banned.chat_id")
+            for ddl in BANNED_UNIQUE_DDL:
+                conn.exec_driver_sql(ddl)
+        for ddl in SURVEY_FTS_DDL + BAN_VERSION_DDL:
+            conn.exec_driver_sql(ddl)
+    load_bans()
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking db function on the database thread pool."""
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+    finally:
+        add_time("db", time.perf_counter() - start)
+
+
+async def ban_async(chat_id: int, username: str | None = None) -> bool:
+    return await run_db(ban, chat_id, username)
+
+
+async def unban_async(chat_id: int) -> bool:
+    return await run_db(unban, chat_id)
+
+
+async def request_unban_async(chat_id: int) -> int | None:
+    return await run_db(request_unban, chat_id)
+
+
+async def decide_unban_async(chat_id: int, request_id: int | None, accept: bool, admin: str) -> UnbanDecision:
+    return await run_db(decide_unban, chat_id, request_id, accept, admin)
+
+
+async def banlist_page_async(
+    limit: int, after: int | None = None, before: int | None = None, tried_unban: bool | None = None
+) -> list[Banned]:
+    return await run_db(banlist_page, limit, after, before, tried_unban)
+
+
+async def create_tables_async() -> None:
+    await run_db(create_tables)
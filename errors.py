@@ -0,0 +1,84 @@
+import hashlib
+import os
+import time
+import traceback
+from typing import TypedDict
+
+from telegram import Bot
+
+from chunking import split_message
+from logs import get_logger
+
+
+logger = get_logger()
+
+ERROR_DIGEST_INTERVAL = int(os.getenv("ERROR_DIGEST_INTERVAL", "600"))
+# Fingerprints not seen for this long are reported in full again.
+ERROR_FORGET_AFTER = 24 * 60 * 60
+MAX_DIGEST_CHATS = 20
+
+
+class ErrorEntry(TypedDict):
+    summary: str
+    repeats: int
+    chats: set[int | str]
+    last_seen: float
+
+
+def fingerprint(err: BaseException) -> str:
+    """Stable id of an error: its type and the code locations of its stack."""
+    frames = traceback.extract_tb(err.__traceback__)
+    key = type(err).__qualname__ + "|" + "|".join(f"{f.filename}:{f.name}:{f.lineno}" for f in frames)
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+class ErrorReporter:
+    """Sends developer error reports without flooding.
+
+    The first occurrence of an error is sent in full. Repeats of the same
+    fingerprint are counted and sent as one digest per interval, with the
+    affected chat ids.
+    """
+
+    def __init__(self, dev_id: int | str):
+        self.dev_id = dev_id
+        self._errors: dict[str, ErrorEntry] = {}
+
+    async def report(self, bot: Bot, err: BaseException, chat_id: int | str | None, title: str) -> None:
+        fp = fingerprint(err)
+        now = time.time()
+        entry = self._errors.get(fp)
+        if entry and now - entry["last_seen"] < ERROR_FORGET_AFTER:
+            entry["repeats"] += 1
+            entry["last_seen"] = now
+            if chat_id is not None:
+                entry["chats"].add(chat_id)
+            return
+        self._errors[fp] = {"summary": f"{type(err).__name__}: {err}", "repeats": 0, "chats": set(), "last_seen": now}
+        text = f"{title}: {err}\nfingerprint {fp}\n" + "".join(traceback.format_exception(err))
+        await self._send(bot, text)
+
+    async def send_digest(self, bot: Bot) -> None:
+        now = time.time()
+        lines = []
+        for fp, entry in list(self._errors.items()):
+            if entry["repeats"]:
+                chats = sorted(map(str, entry["chats"]))
+                more = f" +{len(chats) - MAX_DIGEST_CHATS}" if len(chats) > MAX_DIGEST_CHATS else ""
+                lines.append(
+                    f"{fp} ×{entry['repeats']} {entry['summary'][:200]}\n"
+                    f"  chats: {', '.join(chats[:MAX_DIGEST_CHATS]) or '-'}{more}"
+                )
+                entry["repeats"] = 0
+                entry["chats"] = set()
+            elif now - entry["last_seen"] > ERROR_FORGET_AFTER:
+                del self._errors[fp]
+        if lines:
+            await self._send(bot, "Repeated errors since last digest:\n" + "\n".join(lines))
+
+    async def _send(self, bot: Bot, text: str) -> None:
+        try:
+            for chunk in split_message(text):
+                await bot.send_message(self.dev_id, chunk)
+        except Exception as err:
+            logger.error(f"Could not send error report: {err}")
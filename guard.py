@@ -0,0 +1,117 @@
+"""Cheap checks that run before any handler touches the database or the API."""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Generic, Literal, TypeVar
+
+from telegram import Message
+
+import metrics
+from sender import TokenBucket
+
+
+# Messages a private chat may send: a burst of GUARD_BURST, then GUARD_RATE/s.
+GUARD_RATE = 0.5
+GUARD_BURST = 10
+# Identical surveys from one user within this window are dropped.
+DUPLICATE_WINDOW = 10 * 60
+# At most one "slow down" notice per chat in this interval.
+NOTICE_INTERVAL = 60
+GUARD_CACHE_SIZE = 10000
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+guard_dropped = metrics.counter("bot_guard_dropped_total", "Messages dropped before processing, by reason")
+
+
+class TTLCache(Generic[K, V]):
+    """LRU mapping of at most maxsize entries that expire after ttl seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[K, tuple[float, V]] = OrderedDict()
+
+    def get(self, key: K) -> V | None:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: K, value: V) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def content_key(message: Message) -> str | None:
+    """Hash of a survey message's content, None for commands and other messages."""
+    if message.text:
+        if message.text.startswith("/"):
+            return None
+        body = message.text
+    else:
+        media = message.video or (message.photo[-1] if message.photo else None)
+        if media is None:
+            return None
+        body = media.file_unique_id + "\n" + (message.caption or "")
+    return hashlib.sha1(body.encode()).hexdigest()
+
+
+class SpamGuard:
+    """Per-chat flood and duplicate filter, all in memory.
+
+    Buckets of chats that went quiet expire with the cache, and a full
+    bucket is the same as a new one, so nothing is lost by evicting them.
+    """
+
+    def __init__(self, rate: float = GUARD_RATE, burst: float = GUARD_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: TTLCache[int, TokenBucket] = TTLCache(GUARD_CACHE_SIZE, burst / rate)
+        # chat_id -> {content hash: expiry} of the chat's recent surveys
+        self._seen: TTLCache[int, dict[str, float]] = TTLCache(GUARD_CACHE_SIZE, DUPLICATE_WINDOW)
+        self._notified: TTLCache[int, bool] = TTLCache(GUARD_CACHE_SIZE, NOTICE_INTERVAL)
+
+    def check(self, chat_id: int, message: Message) -> Literal["throttled", "duplicate"] | None:
+        """Why the message should be dropped, or None to let it through."""
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+        self._buckets.set(chat_id, bucket)
+        if not bucket.try_acquire():
+            guard_dropped.inc(reason="throttled")
+            return "throttled"
+        key = content_key(message)
+        if key is not None:
+            now = time.monotonic()
+            seen = {k: expires for k, expires in (self._seen.get(chat_id) or {}).items() if expires > now}
+            if key in seen:
+                guard_dropped.inc(reason="duplicate")
+                return "duplicate"
+            seen[key] = now + DUPLICATE_WINDOW
+            self._seen.set(chat_id, seen)
+        return None
+
+    def forget(self, chat_id: int) -> None:
+        """Let a chat send the same survey again, e.g. after it was rejected."""
+        self._seen.pop(chat_id)
+
+    def should_notify(self, chat_id: int) -> bool:
+        """True once per NOTICE_INTERVAL for a chat."""
+        if self._notified.get(chat_id):
+            return False
+        self._notified.set(chat_id, True)
+        return True
@@ -1,15 +1,75 @@
+import atexit
+import json
 import logging
 import logging.handlers
+import os
+import queue
+import random
 
-def get_logger():
-    logger = logging.getLogger(__name__)
-    logger.setLevel(logging.DEBUG)
+LOG_FILE = os.getenv("LOG_FILE", "cat_log.log")
+# Shard workers (see shard.py) each rotate their own file, cat_log.<shard>.log.
+# Several processes rotating one file would lose records.
+if os.getenv("SHARD_INDEX") is not None:
+    _root, _ext = os.path.splitext(LOG_FILE)
+    LOG_FILE = f"{_root}.{os.environ['SHARD_INDEX']}{_ext}"
+# "json" writes one JSON object per line instead of plain text.
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Share of DEBUG records that are kept, e.g. 0.1 for every tenth.
+LOG_DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", "1"))
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "file": record.filename,
+            "line": record.lineno,
+            "func": record.funcName,
+            "message": record.getMessage(),
+        }
+        return json.dumps(data, ensure_ascii=False)
+
+
+class DebugSampler(logging.Filter):
+    """Keeps only a share of DEBUG records, everything else passes."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+def _setup(logger: logging.Logger) -> None:
+    """Log through a queue, so file writes happen on a background thread."""
+    global _listener
     handler = logging.handlers.RotatingFileHandler(
-        "cat_log.log", maxBytes=50000000, backupCount=5
-    )
-    formatter = logging.Formatter(
-        "%(asctime)s - %(levelname)s - %(filename)s - %(lineno)s - %(funcName)s - %(message)s"
+        LOG_FILE, maxBytes=50000000, backupCount=5, encoding="utf-8"
     )
+    if LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            "%(asctime)s - %(levelname)s - %(filename)s - %(lineno)s - %(funcName)s - %(message)s"
+        )
     handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    if LOG_DEBUG_SAMPLE < 1:
+        queue_handler.addFilter(DebugSampler(LOG_DEBUG_SAMPLE))
+    logger.addHandler(queue_handler)
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger():
+    logger = logging.getLogger(__name__)
+    logger.setLevel(logging.DEBUG)
+    if _listener is None:
+        _setup(logger)
     return logger
@@ -0,0 +1,206 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from typing import Callable
+
+from logs import get_logger
+
+
+logger = get_logger()
+
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Updates slower than this are logged with a breakdown of where time went.
+SLOW_UPDATE_SECONDS = float(os.getenv("SLOW_UPDATE_SECONDS", "0"))
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Per-update time spent in the database and in Bot API calls.
+update_stats: contextvars.ContextVar[dict | None] = contextvars.ContextVar("update_stats", default=None)
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, doc: str):
+        self.name = name
+        self.doc = doc
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            lines += [f"{self.name}{_labels(key)} {value}" for key, value in self._values.items()]
+        return lines
+
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time."""
+
+    def __init__(self, name: str, doc: str, func: Callable[[], float]):
+        self.name = name
+        self.doc = doc
+        self.func = func
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} gauge", f"{self.name} {self.func()}"]
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, buckets: tuple = BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.buckets = buckets
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._values.setdefault(key, [[0] * len(self.buckets), 0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+            counts[1] += 1
+            counts[2] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (buckets, count, total) in self._values.items():
+                for bound, n in zip(self.buckets, buckets):
+                    lines.append(f"{self.name}_bucket{_labels(key + (('le', bound),))} {n}")
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.name}_count{_labels(key)} {count}")
+                lines.append(f"{self.name}_sum{_labels(key)} {total}")
+        return lines
+
+
+registry: list[Counter | Gauge | Histogram] = []
+
+
+def counter(name: str, doc: str) -> Counter:
+    metric = Counter(name, doc)
+    registry.append(metric)
+    return metric
+
+
+def histogram(name: str, doc: str) -> Histogram:
+    metric = Histogram(name, doc)
+    registry.append(metric)
+    return metric
+
+
+def gauge(name: str, doc: str, func: Callable[[], float]) -> Gauge:
+    metric = Gauge(name, doc, func)
+    registry.append(metric)
+    return metric
+
+
+handler_seconds = histogram("bot_handler_seconds", "Handler run time")
+handler_errors = counter("bot_handler_errors_total", "Handlers that raised")
+db_seconds = histogram("bot_db_seconds", "Database function run time")
+db_errors = counter("bot_db_errors_total", "Database functions that raised")
+api_seconds = histogram("bot_api_seconds", "Bot API call time, including retries")
+api_calls = counter("bot_api_calls_total", "Bot API calls by outcome")
+api_retries = counter("bot_api_retries_total", "Bot API call retries by reason")
+slow_updates = counter("bot_slow_updates_total", "Updates slower than SLOW_UPDATE_SECONDS")
+
+
+def render() -> str:
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+def add_time(kind: str, seconds: float) -> None:
+    stats = update_stats.get()
+    if stats is not None:
+        stats[kind] = stats.get(kind, 0) + seconds
+        stats[f"{kind}_calls"] = stats.get(f"{kind}_calls", 0) + 1
+
+
+def handler(func):
+    """Time an update handler."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            handler_errors.inc(handler=func.__name__)
+            raise
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, handler=func.__name__)
+
+    return wrapper
+
+
+def timed_db(func):
+    """Time a blocking db function. Safe to call from worker threads."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            db_errors.inc(function=func.__name__)
+            raise
+        finally:
+            db_seconds.observe(time.perf_counter() - start, function=func.__name__)
+
+    return wrapper
+
+
+def report_slow_update(update: object, seconds: float, stats: dict) -> None:
+    slow_updates.inc()
+    update_id = getattr(update, "update_id", None)
+    logger.warning(
+        f"Slow update {update_id}: {seconds:.2f}s total, "
+        f"db {stats.get('db', 0):.2f}s in {stats.get('db_calls', 0)} calls, "
+        f"api {stats.get('api', 0):.2f}s in {stats.get('api_calls', 0)} calls"
+    )
+
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        if request.split()[1:2] == [b"/metrics"]:
+            body = render().encode()
+            status = b"200 OK"
+        else:
+            body, status = b"not found\n", b"404 Not Found"
+        writer.write(
+            b"HTTP/1.1 " + status + b"\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(port: int, host: str = METRICS_HOST) -> asyncio.Server:
+    """Serve the metrics in Prometheus text format on /metrics."""
+    server = await asyncio.start_server(_serve, host, port)
+    logger.info(f"Metrics served on http://{host}:{port}/metrics")
+    return server
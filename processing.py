@@ -0,0 +1,61 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently, but one at a time per chat.
+
+    Updates of a single chat keep their arrival order, so multi-part
+    surveys from one user are forwarded in the order they were sent.
+    """
+
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES):
+        super().__init__(max_concurrent_updates)
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._users: dict[int, int] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # Wait for the chat's turn before taking one of the concurrency
+        # slots, so updates queued behind a busy chat do not hold slots.
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await super().process_update(update, coroutine)
+            return
+        lock = self._locks.setdefault(chat.id, asyncio.Lock())
+        self._users[chat.id] = self._users.get(chat.id, 0) + 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            self._users[chat.id] -= 1
+            if not self._users[chat.id]:
+                del self._users[chat.id]
+                del self._locks[chat.id]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        if not metrics.SLOW_UPDATE_SECONDS:
+            await coroutine
+            return
+        stats: dict = {}
+        metrics.update_stats.set(stats)
+        start = time.perf_counter()
+        await coroutine
+        elapsed = time.perf_counter() - start
+        if elapsed > metrics.SLOW_UPDATE_SECONDS:
+            metrics.report_slow_update(update, elapsed, stats)
@@ -0,0 +1,198 @@
+import asyncio
+import os
+import random
+import time
+from datetime import timedelta
+from typing import Any, Callable, Coroutine
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+from logs import get_logger
+
+
+logger = get_logger()
+
+# Telegram flood limits: ~30 messages/s overall, ~1/s per private chat, 20/min per group.
+GLOBAL_RATE = 30
+PRIVATE_RATE = 1
+GROUP_RATE = 20 / 60
+MAX_PENDING = int(os.getenv("SEND_QUEUE_SIZE", "500"))
+MAX_RETRIES = 5
+# Calls that are not messages to a chat and are not flood limited.
+# RetryAfter for this many different chats within FLOOD_WINDOW seconds is
+# taken as a bot-wide flood limit and pauses every call.
+GLOBAL_FLOOD_CHATS = 3
+FLOOD_WINDOW = 1.0
+UNLIMITED = {"getUpdates", "getMe", "setWebhook", "deleteWebhook", "getWebhookInfo", "answerCallbackQuery", "getFile"}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # Set when Telegram answers RetryAfter for this chat.
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity and not self._lock.locked() and self.paused_until <= self.updated
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available, without waiting."""
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def acquire(self) -> None:
+        """Wait until a token is available. Waiters are served in order."""
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+def chat_key(chat_id: int | str) -> int | str:
+    """The same key for a chat whether its id came as int or str."""
+    try:
+        return int(chat_id)
+    except ValueError:
+        return chat_id
+
+
+def retry_delay(err: RetryAfter) -> float:
+    delay = err.retry_after
+    if isinstance(delay, timedelta):
+        return delay.total_seconds()
+    return float(delay)
+
+
+class FloodLimiter(BaseRateLimiter[None]):
+    """Rate limiter for every outbound bot call.
+
+    Applies a global and a per-chat token bucket, waits out RetryAfter
+    exactly for the flooded chat (for every chat only if several floods at
+    once) and retries network errors with jittered exponential backoff.
+    At most MAX_PENDING calls are queued; further callers wait for a slot.
+    """
+
+    def __init__(self, max_pending: int = MAX_PENDING, max_retries: int = MAX_RETRIES, shares: int = 1):
+        """shares is the number of processes sending as the same bot. Each
+        one gets that share of the global and group limits. Private chats
+        are served by a single process, so their limit is not split.
+        """
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self.shares = shares
+        self._global = TokenBucket(GLOBAL_RATE / shares, max(1.0, GLOBAL_RATE / shares))
+        self._chats: dict[int | str, TokenBucket] = {}
+        self._pending = asyncio.Semaphore(max_pending)
+        self._paused_until = 0.0
+        # chat -> time of its last RetryAfter
+        self._floods: dict[int | str, float] = {}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        chat_id = chat_key(chat_id)
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 1000:
+                self._chats = {k: v for k, v in self._chats.items() if not v.idle()}
+            is_group = str(chat_id).startswith("-")
+            if is_group:
+                bucket = TokenBucket(GROUP_RATE / self.shares, max(1.0, 3 / self.shares))
+            else:
+                bucket = TokenBucket(PRIVATE_RATE, 3)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _wait_for_slot(self, chat_id: int | str | None) -> None:
+        paused_until = self._paused_until
+        if chat_id is not None:
+            bucket = self._chat_bucket(chat_id)
+            await bucket.acquire()
+            paused_until = max(paused_until, bucket.paused_until)
+        await self._global.acquire()
+        pause = max(paused_until, self._paused_until) - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+    def _pause(self, chat_id: int | str | None, delay: float) -> None:
+        """Hold back the flooded chat, or every call if the flood looks bot-wide."""
+        now = time.monotonic()
+        until = now + delay
+        if chat_id is None:
+            self._paused_until = max(self._paused_until, until)
+            return
+        bucket = self._chat_bucket(chat_id)
+        bucket.paused_until = max(bucket.paused_until, until)
+        self._floods = {chat: at for chat, at in self._floods.items() if now - at < FLOOD_WINDOW}
+        self._floods[chat_key(chat_id)] = now
+        if len(self._floods) >= GLOBAL_FLOOD_CHATS:
+            self._paused_until = max(self._paused_until, until)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, bool | dict[str, Any] | list[dict[str, Any]]]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: None,
+    ) -> bool | dict[str, Any] | list[dict[str, Any]]:
+        if endpoint in UNLIMITED:
+            return await callback(*args, **kwargs)
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await self._send(callback, args, kwargs, endpoint, data.get("chat_id"))
+            outcome = "ok"
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.api_calls.inc(method=endpoint, outcome=outcome)
+            metrics.api_seconds.observe(elapsed, method=endpoint)
+            metrics.add_time("api", elapsed)
+
+    async def _send(self, callback, args, kwargs, endpoint: str, chat_id: int | str | None):
+        async with self._pending:
+            attempt = 0
+            while True:
+                await self._wait_for_slot(chat_id)
+                try:
+                    return await callback(*args, **kwargs)
+                except RetryAfter as err:
+                    delay = retry_delay(err)
+                    self._pause(chat_id, delay)
+                    logger.warning(f"Flood limit on {endpoint} for {chat_id}, waiting {delay}s")
+                    if attempt >= self.max_retries:
+                        raise
+                    metrics.api_retries.inc(method=endpoint, reason="flood")
+                except BadRequest:
+                    raise
+                except NetworkError as err:
+                    if attempt >= self.max_retries:
+                        raise
+                    metrics.api_retries.inc(method=endpoint, reason="network")
+                    delay = min(60, 2**attempt) + random.uniform(0, 1)
+                    logger.warning(f"{err} on {endpoint} for {chat_id}, retry {attempt + 1} in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                attempt += 1
@@ -0,0 +1,115 @@
+"""Run the bot as several worker processes behind one update source.
+
+The front process long-polls Telegram and routes every update to a
+worker by chat id, so all updates of one chat are handled, in order, by
+the same process. Workers share banned.db in WAL mode and reload their
+ban cache when another process changes it.
+
+    SHARD_COUNT=4 python shard.py
+"""
+import asyncio
+import multiprocessing
+import os
+import queue
+
+from dotenv import load_dotenv
+from telegram import Bot, Update
+from telegram.error import TelegramError
+
+from logs import get_logger
+
+load_dotenv()
+logger = get_logger()
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "4"))
+# Updates a worker may have queued before the front process waits for it.
+SHARD_QUEUE_SIZE = 1000
+
+
+def shard_of(update: Update, shards: int) -> int:
+    if update.effective_chat:
+        key = update.effective_chat.id
+    elif update.effective_user:
+        key = update.effective_user.id
+    else:
+        key = update.update_id
+    return key % shards
+
+
+async def run_worker(updates: multiprocessing.Queue) -> None:
+    import bot
+
+    app = bot.build_application()
+    loop = asyncio.get_running_loop()
+    async with app:
+        await app.start()
+        # post_init and post_shutdown only run from run_polling/run_webhook.
+        await bot.on_startup(app)
+        try:
+            while True:
+                try:
+                    data = await loop.run_in_executor(None, updates.get, True, 1)
+                except queue.Empty:
+                    continue
+                if data is None:
+                    break
+                await app.update_queue.put(Update.de_json(data, app.bot))
+        finally:
+            await bot.on_shutdown(app)
+            await app.stop()
+
+
+def worker(updates: multiprocessing.Queue) -> None:
+    import db
+
+    db.load_bans()
+    asyncio.run(run_worker(updates))
+
+
+async def poll(queues: list[multiprocessing.Queue]) -> None:
+    """Long-poll Telegram and hand each update to its shard."""
+    loop = asyncio.get_running_loop()
+    offset = None
+    async with Bot(os.environ["TOKEN"]) as telegram_bot:
+        while True:
+            try:
+                updates = await telegram_bot.get_updates(
+                    offset=offset, timeout=120, read_timeout=130, allowed_updates=Update.ALL_TYPES
+                )
+            except TelegramError as err:
+                logger.warning(f"getUpdates failed: {err}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                target = queues[shard_of(update, len(queues))]
+                await loop.run_in_executor(None, target.put, update.to_dict())
+                offset = update.update_id + 1
+
+
+def main() -> None:
+    import db
+
+    db.create_tables()
+    ctx = multiprocessing.get_context("spawn")
+    queues = [ctx.Queue(SHARD_QUEUE_SIZE) for _ in range(SHARD_COUNT)]
+    processes = [ctx.Process(target=worker, args=(q,), daemon=True) for q in queues]
+    for index, process in enumerate(processes):
+        # A spawned worker starts with a copy of this environment, and
+        # logs.py and bot.py read their shard from it at import time.
+        os.environ["SHARD_INDEX"] = str(index)
+        os.environ["SHARD_COUNT"] = str(SHARD_COUNT)
+        process.start()
+    del os.environ["SHARD_INDEX"]
+    logger.info(f"Started {SHARD_COUNT} worker processes")
+    try:
+        asyncio.run(poll(queues))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for q in queues:
+            q.put(None)
+        for process in processes:
+            process.join(timeout=30)
+
+
+if __name__ == "__main__":
+    main()